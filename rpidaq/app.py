@@ -1,11 +1,17 @@
 # %%
 import sys
 import os
+import asyncio
+import functools
 import json
-from time import sleep
 import yaml
-from sps30.sps30 import SPS30
-from scd30.scd30 import SCD30
+from common.runtime import Runtime
+from common.sensors import open_bus, open_sensors, start_acquisition, stop_acquisition
+from common.aggregate import WindowAggregator
+from common.quantiles import QuantileTracker
+from common.writer import CSVWriter
+from common.timeseries import SegmentWriter
+from common.database import SQLiteWriter
 
 # %%
 if __name__ == "__main__":
@@ -15,66 +21,152 @@ if __name__ == "__main__":
         cfg = yaml.safe_load(f)
         f.close()
 
-    pm_sensor = None
-    if cfg["sensors"]["sps30"]:
-        pm_sensor = SPS30()
+    clock, bus = open_bus(cfg)
+    sensors = open_sensors(cfg, clock, bus)
+
+    # file sinks, called on the runtime's executor with every sample as soon as it was read; kept open and buffered
+    pm_writer = CSVWriter(cfg['data'], "sps30", cfg.get("precision"), clock=clock, **cfg.get("writer", {}))
+    co2_writer = CSVWriter(cfg['data'], "scd30", cfg.get("precision"), clock=clock, **cfg.get("writer", {}))
+    # optional binary segments of the raw samples for fast range queries (common.timeseries.SegmentReader)
+    segment_writers = {}
+    if cfg.get("timeseries"):
+        segment_writers = {name: SegmentWriter(cfg['data'], name, sensor.record, clock=clock)
+                           for name, sensor in sensors.items()}
+    # optional SQLite database of the raw samples, inserted in batches
+    database = None
+    if cfg.get("sqlite"):
+        database = SQLiteWriter(clock=clock, **cfg["sqlite"])
+
+    def write_summary(path, result):
+        with open(path, "at") as fh:
+            fh.write(result.to_csv(cfg.get("precision")) + "\n")
+
+    # window statistics, written to <data>/<sensor>-<window>s.json instead of the raw samples
+    def aggregate_sink(name, sensor):
+        aggregators = []
+        for spec in cfg.get("aggregate") or []:
+            suffix = f"{spec['window']}s" + (f"-{spec['hop']}s" if spec.get("hop") else "")
+            path = f"{os.path.expanduser(cfg['data'])}/{name}-{suffix}.json"
+            aggregator = WindowAggregator(sensor.record, spec["window"], spec.get("hop"),
+                                          callback=functools.partial(write_summary, path))
+            with open(path, "wt") as fh:
+                fh.write(json.dumps({"Schema": aggregator.record.schema(), "Window": spec}))
+                fh.write("\n")
+            aggregators.append(aggregator)
+
+        def aggregate(result):
+            for aggregator in aggregators:
+                aggregator.add(result)
+        return aggregate
+
+    # percentiles per period of selected channels, appended to <data>/<sensor>-p<period>s.json
+    trackers = []
+
+    def quantile_sink(name, sensor):
+        quantiles = cfg.get("quantiles") or {}
+        sensor_trackers = []
+        for period in quantiles.get("periods", []):
+            path = f"{os.path.expanduser(cfg['data'])}/{name}-p{period}s"
+            tracker = QuantileTracker(sensor.record, quantiles[name], period, quantiles.get("quantiles", (0.5, 0.95)),
+                                      path=path + ".state", callback=functools.partial(write_summary, path + ".json"))
+            if not os.path.exists(path + ".json"):
+                with open(path + ".json", "wt") as fh:
+                    fh.write(json.dumps({"Schema": tracker.record.schema(), "Period": period}))
+                    fh.write("\n")
+            sensor_trackers.append(tracker)
+        trackers.extend(sensor_trackers)
+
+        def track(result):
+            for tracker in sensor_trackers:
+                tracker.add(result)
+        return track
+
+    def save_quantiles():
+        for tracker in trackers:
+            tracker.save()
+
+    pm_sensor = sensors.get("sps30")
+    if pm_sensor:
         pm_sensor_cfg = {
             "Product type": pm_sensor.get_product_type(), 
             "Serial number": pm_sensor.get_serial_number(),
             "Firmware version": pm_sensor.get_firmware_version(),
             "Status register": pm_sensor.get_status_register(),
-            "Auto cleaning interval": pm_sensor.get_auto_cleaning_interval()
+            "Auto cleaning interval": pm_sensor.get_auto_cleaning_interval(),
+            "Schema": pm_sensor.record.schema()
             }
         print(pm_sensor_cfg)
         with open(os.path.expanduser(cfg['data']) + "/sps30.json", "wt") as fh:
             fh.write(json.dumps(pm_sensor_cfg))
             fh.write("\n")
-        pm_sensor.start_measurement()
-        sleep(5)
 
-    co2_sensor = None    
-    if cfg["sensors"]["scd30"]:
-        co2_sensor = SCD30(sampling_period=60)
+    co2_sensor = sensors.get("scd30")
+    if co2_sensor:
         co2_sensor_cfg = {
             "Product type": "SCD30",
-            "Firmware version": co2_sensor.get_firmware_version()
+            "Firmware version": co2_sensor.get_firmware_version(),
+            "Schema": co2_sensor.record.schema()
             }
         print(co2_sensor_cfg)
         with open(os.path.expanduser(cfg['data']) + "/scd30.json", "wt") as fh:
             fh.write(json.dumps(co2_sensor_cfg))
             fh.write("\n")
-        co2_sensor.start_measurement()
-        sleep(5)
-
-    # main loop
-    # TODO: proper scheduling instead of sleep()
-    while True:
-        try:
-            if pm_sensor:
-                pm_result = pm_sensor.get_measurement()
-                with open(os.path.expanduser(cfg['data']) + "/sps30.json", "at") as fh:
-#                     fh.write(pm_result)
-                    fh.write(f"{pm_result['timestamp']}")
-                    fh.write(f",{pm_result['mass_density']['pm1.0']}")
-                    fh.write(f",{pm_result['mass_density']['pm2.5']}")
-                    fh.write(f",{pm_result['mass_density']['pm4.0']}")
-                    fh.write(f",{pm_result['mass_density']['pm10']}")
-                    fh.write(f",{pm_result['particle_count']['pm0.5']}")
-                    fh.write(f",{pm_result['particle_count']['pm1.0']}")
-                    fh.write(f",{pm_result['particle_count']['pm2.5']}")
-                    fh.write(f",{pm_result['particle_count']['pm4.0']}")
-                    fh.write(f",{pm_result['particle_count']['pm10']}\n")
-                print(json.dumps(pm_result, indent=2))
-
-            if co2_sensor:
-                result = co2_sensor.get_measurement()
-                with open(os.path.expanduser(cfg['data']) + "/scd30.json", "at") as fh:
-                    fh.write(f"{result['timestamp']},{result['CO2']},{result['T']},{result['RH']}\n")
-                print(json.dumps(result, indent=2))
-            sleep(60)
-
-        except KeyboardInterrupt:
-            print("Stopping measurement...")
-            pm_sensor.stop_measurement()
-            co2_sensor.stop_measurement()
-            sys.exit()
+
+    acquisition, sensors = start_acquisition(cfg, sensors)
+    pm_sensor = sensors.get("sps30")
+    co2_sensor = sensors.get("scd30")
+    clock.sleep(5)
+
+    # main loop: sinks and console output as tasks of one asyncio runtime
+    def show_pm_sensor():
+        pm_result = pm_sensor.get_measurement()
+        if pm_result:
+            print(pm_result.to_json(cfg.get("precision"), indent=2))
+
+    def show_co2_sensor():
+        result = co2_sensor.get_measurement()
+        if result:
+            print(result.to_json(cfg.get("precision"), indent=2))
+
+    runtime = Runtime(clock, **cfg.get("runtime", {}))
+    if pm_sensor:
+        runtime.add_sensor("sps30", pm_sensor)
+        if cfg.get("aggregate"):
+            runtime.add_sink("sps30 aggregate", ["sps30"], aggregate_sink("sps30", pm_sensor))
+        else:
+            runtime.add_sink("sps30.json", ["sps30"], pm_writer.write)
+        if (cfg.get("quantiles") or {}).get("sps30"):
+            runtime.add_sink("sps30 quantiles", ["sps30"], quantile_sink("sps30", pm_sensor))
+        runtime.add_periodic("show sps30", cfg.get("schedule", {}).get("sps30", 60), show_pm_sensor)
+    if co2_sensor:
+        runtime.add_sensor("scd30", co2_sensor)
+        if cfg.get("aggregate"):
+            runtime.add_sink("scd30 aggregate", ["scd30"], aggregate_sink("scd30", co2_sensor))
+        else:
+            runtime.add_sink("scd30.json", ["scd30"], co2_writer.write)
+        if (cfg.get("quantiles") or {}).get("scd30"):
+            runtime.add_sink("scd30 quantiles", ["scd30"], quantile_sink("scd30", co2_sensor))
+        runtime.add_periodic("show scd30", cfg.get("schedule", {}).get("scd30", 60), show_co2_sensor)
+    for name, writer in segment_writers.items():
+        runtime.add_sink(f"{name}.bin", [name], writer.write)
+    if database:
+        runtime.add_sink("sqlite", list(sensors), database.write)
+    if trackers:
+        runtime.add_periodic("save quantiles", cfg["quantiles"].get("save", 60), save_quantiles)
+
+    try:
+        asyncio.run(runtime.run())
+
+    except KeyboardInterrupt:
+        print("Stopping measurement...")
+        print(f"Runtime: {runtime.get_stats()}")
+        save_quantiles()
+        pm_writer.close()
+        co2_writer.close()
+        for writer in segment_writers.values():
+            writer.close()
+        if database:
+            database.close()
+            print(f"SQLite: {database.get_stats()}")
+        stop_acquisition(acquisition, sensors)
+        sys.exit()
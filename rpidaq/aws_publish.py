@@ -1,5 +1,6 @@
 import os
 import argparse
+import asyncio
 import json
 import sys
 import threading
@@ -11,8 +12,14 @@ import yaml
 from awscrt import io, mqtt, auth, http, exceptions
 from awsiot import mqtt_connection_builder
 from getmac import get_mac_address as gma
-from sps30.sps30 import SPS30
-from scd30.scd30 import SCD30
+from common.sensors import open_bus, open_sensors, start_acquisition, stop_acquisition
+from common.runtime import Runtime
+from common.aggregate import WindowAggregator
+from common.quantiles import QuantileTracker
+from common.deadband import Deadband
+from common.writer import CSVWriter
+from common.rotation import Archiver
+from common.outbox import Outbox
 
 # modified from example provided by Gary A. Stafford
 # MQTT connection code is modified version of aws-iot-device-sdk-python-v2 sample:
@@ -22,6 +29,8 @@ from scd30.scd30 import SCD30
 count: int = 0  # from args
 received_count: int = 0
 received_all_event = threading.Event()
+# set while the MQTT connection is up
+connected = threading.Event()
 
 
 def set_mqtt_connection(args, client_bootstrap):
@@ -101,12 +110,15 @@ def parse_args(cfg):
 
 # Callback when connection is accidentally lost.
 def on_connection_interrupted(connection, error, **kwargs):
+    connected.clear()
     print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())} Connection interrupted. error: {error}")
 
 
 # Callback when an interrupted connection is re-established.
 def on_connection_resumed(connection, return_code, session_present, **kwargs):
     print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())} Connection resumed. return_code: {return_code} session_present: {session_present}")
+    if return_code == mqtt.ConnectReturnCode.ACCEPTED:
+        connected.set()
 
     if return_code == mqtt.ConnectReturnCode.ACCEPTED and not session_present:
         print("Session did not persist. Resubscribing to existing topics...")
@@ -157,36 +169,41 @@ def main():
     print(gma())
 
     # initialize sensors
-    pm_sensor = None
-    if cfg["sensors"]["sps30"]:
-        pm_sensor = SPS30()
+    clock, bus = open_bus(cfg)
+    sensors = open_sensors(cfg, clock, bus)
+
+    pm_sensor = sensors.get("sps30")
+    if pm_sensor:
         pm_sensor_cfg = {
             "Product type": pm_sensor.get_product_type(), 
             "Serial number": pm_sensor.get_serial_number(),
             "Firmware version": pm_sensor.get_firmware_version(),
             "Status register": pm_sensor.get_status_register(),
-            "Auto cleaning interval": pm_sensor.get_auto_cleaning_interval()
+            "Auto cleaning interval": pm_sensor.get_auto_cleaning_interval(),
+            "Schema": pm_sensor.record.schema()
             }
         print(pm_sensor_cfg)
         with open(os.path.expanduser(cfg['data']) + "/sps30.json", "wt") as fh:
             fh.write(json.dumps(pm_sensor_cfg))
             fh.write("\n")
-        pm_sensor.start_measurement()
-        time.sleep(1)
 
-    co2_sensor = None    
-    if cfg["sensors"]["scd30"]:
-        co2_sensor = SCD30(sampling_period=cfg["scd30"]["sampling_period"], pressure=cfg["scd30"]["pressure"])
+    co2_sensor = sensors.get("scd30")
+    if co2_sensor:
         co2_sensor_cfg = {
             "Product type": "SCD30",
-            "Firmware version": co2_sensor.get_firmware_version()
+            "Firmware version": co2_sensor.get_firmware_version(),
+            "Schema": co2_sensor.record.schema()
             }
         print(co2_sensor_cfg)
         with open(os.path.expanduser(cfg['data']) + "/scd30.json", "wt") as fh:
             fh.write(json.dumps(co2_sensor_cfg))
             fh.write("\n")
-        co2_sensor.start_measurement()
-        time.sleep(1)
+
+    # drivers in this process, or in a separate acquisition process away from the awscrt callbacks and JSON publishing
+    acquisition, sensors = start_acquisition(cfg, sensors)
+    pm_sensor = sensors.get("sps30")
+    co2_sensor = sensors.get("scd30")
+    clock.sleep(1)
 
     # spin up resources
     event_loop_group = io.EventLoopGroup(1)
@@ -204,6 +221,7 @@ def main():
     connect_future.result()
     print(connect_future.result())
     print("Connected!")
+    connected.set()
 
     # Subscribe (this will pull in messages down from other devices)
 #     print("Subscribing to topic '{}'...".format(args.topic))
@@ -214,79 +232,202 @@ def main():
 #     subscribe_result = subscribe_future.result()
 #     print("Subscribed with {}".format(str(subscribe_result['qos'])))
 
-    while True:
-        # Create message payload
-        pm_sensor_result = pm_sensor.get_measurement()
-        co2_sensor_result = co2_sensor.get_measurement()
+    # closed daily files are compressed in the background
+    archiver = None
+    if cfg.get("archive"):
+        archiver = Archiver(**cfg["archive"])
+        today = time.strftime("%Y%m%d", time.gmtime(clock.time()))
+        for name in ("sps30", "scd30"):
+            archiver.sweep(cfg['data'], name, today)
+
+    # file sinks, called on the runtime's executor with every sample as soon as it was read;
+    # kept open and buffered, one file per UTC day
+    pm_writer = CSVWriter(cfg['data'], "sps30", cfg.get("precision"), daily=True, clock=clock,
+                          on_rollover=archiver.submit if archiver else None, **cfg.get("writer", {}))
+    co2_writer = CSVWriter(cfg['data'], "scd30", cfg.get("precision"), daily=True, clock=clock,
+                           on_rollover=archiver.submit if archiver else None, **cfg.get("writer", {}))
+
+    device_id = gma()
+
+    # only publish on meaningful change of a value, or after the heartbeat interval
+    deadband = None
+    if cfg["aws"].get("deadband"):
+        deadband = Deadband(**cfg["aws"]["deadband"])
+
+    async def publish():
+        # Create message payload from the latest samples
+        pm_sensor_result = pm_sensor.get_measurement() if pm_sensor else None
+        co2_sensor_result = co2_sensor.get_measurement() if co2_sensor else None
 #         print(f"scd30 returned: {co2_sensor_result}")
 #         payload_rndnum = get_rndnum()
 #         print(payload_rndnum)
 
         payload = {
-            "device_id": gma(),
-            "ts": time.time(),
+            "device_id": device_id,
+            "ts": clock.time(),
             "data": {
 #                 "rndnum": payload_rndnum["rndnum"],
-                "dtm_pm_sensor": pm_sensor_result['timestamp'],
-                "mass_density_pm1.0": pm_sensor_result['mass_density']['pm1.0'],
-                "mass_density_pm2.5": pm_sensor_result['mass_density']['pm2.5'],
-                "mass_density_pm4.0": pm_sensor_result['mass_density']['pm4.0'],
-                "mass_density_pm10": pm_sensor_result['mass_density']['pm10'],
-                "particle_count_pm0.5": pm_sensor_result['particle_count']['pm0.5'],
-                "particle_count_pm1.0":pm_sensor_result['particle_count']['pm1.0'],
-                "particle_count_pm2.5":pm_sensor_result['particle_count']['pm2.5'],
-                "particle_count_pm4.0":pm_sensor_result['particle_count']['pm4.0'],
-                "particle_count_pm10":pm_sensor_result['particle_count']['pm10'],
-                "dtm_co2_sensor": co2_sensor_result['timestamp'],
-                "CO2": co2_sensor_result['CO2'],
-                "T": co2_sensor_result['T'],
-                "RH": co2_sensor_result['RH']
+                "dtm_pm_sensor": pm_sensor_result.isoformat() if pm_sensor_result else None,
+                "dtm_co2_sensor": co2_sensor_result.isoformat() if co2_sensor_result else None
             }
         }
-
-        # persist data in file
-        dte = time.strftime("%Y%m%d", time.gmtime())
-        if pm_sensor:
-            with open(f"{os.path.expanduser(cfg['data'])}/sps30-{dte}.json", "at") as fh:
-                fh.write(f"{pm_sensor_result['timestamp']}")
-                fh.write(f",{pm_sensor_result['mass_density']['pm1.0']}")
-                fh.write(f",{pm_sensor_result['mass_density']['pm2.5']}")
-                fh.write(f",{pm_sensor_result['mass_density']['pm4.0']}")
-                fh.write(f",{pm_sensor_result['mass_density']['pm10']}")
-                fh.write(f",{pm_sensor_result['particle_count']['pm0.5']}")
-                fh.write(f",{pm_sensor_result['particle_count']['pm1.0']}")
-                fh.write(f",{pm_sensor_result['particle_count']['pm2.5']}")
-                fh.write(f",{pm_sensor_result['particle_count']['pm4.0']}")
-                fh.write(f",{pm_sensor_result['particle_count']['pm10']}\n")
-        if co2_sensor:
-            with open(f"{os.path.expanduser(cfg['data'])}/scd30-{dte}.json", "at") as fh:
-                fh.write(f"{co2_sensor_result['timestamp']}")
-                fh.write(f",{co2_sensor_result['CO2']}")
-                fh.write(f",{co2_sensor_result['T']}")
-                fh.write(f",{co2_sensor_result['RH']}\n")
+        if pm_sensor_result:
+            payload["data"].update(pm_sensor_result.items(cfg.get("precision")))
+        if co2_sensor_result:
+            payload["data"].update(co2_sensor_result.items(cfg.get("precision")))
 
         # Don't send bad messages!
 #         if payload["data"]["temp"] is not None \
 #                 and payload["data"]["humidity"] is not None \
 #                 and payload["data"]["co"] is not None:
         if payload["data"]["dtm_pm_sensor"] is not None:            # Publish Message
-            message_json = json.dumps(payload, sort_keys=True, indent=None, separators=(',', ':'))
-
-            try:
-                mqtt_connection.publish(
-                    topic=args.topic,
-                    payload=message_json,
-                    qos=mqtt.QoS.AT_LEAST_ONCE)
-                print(f"message {message_json} published.")
-            except mqtt.SubscribeError as err:
-                print(".SubscribeError: {}".format(err))
-            except exceptions.AwsCrtError as err:
-                print("AwsCrtError: {}".format(err))
-            else:
-                time.sleep(args.frequency)
+            if deadband and not deadband.check(payload["data"], payload["ts"]):
+                return
+            if await send(payload) and deadband:
+                deadband.commit(payload["data"], payload["ts"])
         else:
             print("sensor failure...retrying...")
 
+    # durable queue of the messages: written before they are published, removed by the PUBACK
+    outbox = None
+    in_flight = set()
+    if cfg["aws"].get("outbox"):
+        outbox_cfg = dict(cfg["aws"]["outbox"])
+        catch_up_rate = outbox_cfg.pop("rate", 5)
+        catch_up_interval = outbox_cfg.pop("interval", 10)
+        outbox = Outbox(**outbox_cfg)
+        print(f"Outbox: {outbox.get_stats()}")
+
+    async def deliver(message_json, entry_id=None):
+        if entry_id is not None:
+            in_flight.add(entry_id)
+        try:
+            publish_future, packet_id = mqtt_connection.publish(
+                topic=args.topic,
+                payload=message_json,
+                qos=mqtt.QoS.AT_LEAST_ONCE)
+            # completes with the PUBACK, without blocking the other tasks
+            await asyncio.wrap_future(publish_future)
+            print(f"message {message_json} published.")
+            if entry_id is not None:
+                outbox.ack(entry_id)
+            return True
+        except mqtt.SubscribeError as err:
+            print(".SubscribeError: {}".format(err))
+        except exceptions.AwsCrtError as err:
+            print("AwsCrtError: {}".format(err))
+        finally:
+            in_flight.discard(entry_id)
+        return False
+
+    async def send(payload):
+        message_json = json.dumps(payload, sort_keys=True, indent=None, separators=(',', ':'))
+        if not outbox:
+            return await deliver(message_json)
+
+        entry_id = await runtime.call(outbox.put, message_json.encode())
+        # while the link is down, catch_up() sends it after reconnecting instead of awscrt's offline queue in RAM
+        if connected.is_set():
+            await deliver(message_json, entry_id)
+        return True
+
+    async def catch_up():
+        # replay unacknowledged messages (link down, restart), oldest first, at most catch_up_rate per s
+        while connected.is_set():
+            entries = [(entry_id, message) for entry_id, message in await runtime.call(outbox.pending, 100)
+                       if entry_id not in in_flight]
+            if not entries:
+                return
+            for entry_id, message in entries:
+                if not connected.is_set() or not await deliver(message.decode(), entry_id):
+                    return
+                await asyncio.sleep(1 / catch_up_rate)
+
+    # window statistics published in place of the latest samples, one message per completed window
+    def aggregate_sink(sensor):
+        aggregators = [WindowAggregator(sensor.record, spec["window"], spec.get("hop"))
+                       for spec in cfg.get("aggregate") or []]
+
+        async def aggregate(result):
+            for aggregator in aggregators:
+                for window in aggregator.add(result):
+                    await send({
+                        "device_id": device_id,
+                        "ts": clock.time(),
+                        "sensor": window.SENSOR,
+                        "window": aggregator.window,
+                        "hop": aggregator.hop,
+                        "data": window.to_dict(cfg.get("precision"))
+                    })
+        return aggregate
+
+    # percentiles per period of selected channels, published when a period is complete
+    trackers = []
+
+    def quantile_sink(name, sensor):
+        quantiles = cfg.get("quantiles") or {}
+        sensor_trackers = [QuantileTracker(sensor.record, quantiles[name], period, quantiles.get("quantiles", (0.5, 0.95)),
+                                           path=f"{os.path.expanduser(cfg['data'])}/{name}-p{period}s.state")
+                           for period in quantiles.get("periods", [])]
+        trackers.extend(sensor_trackers)
+
+        async def track(result):
+            for tracker in sensor_trackers:
+                for summary in tracker.add(result):
+                    await send({
+                        "device_id": device_id,
+                        "ts": clock.time(),
+                        "sensor": summary.SENSOR,
+                        "period": tracker.period,
+                        "data": summary.to_dict(cfg.get("precision"))
+                    })
+        return track
+
+    def save_quantiles():
+        for tracker in trackers:
+            tracker.save()
+
+    runtime = Runtime(clock, **cfg.get("runtime", {}))
+    if pm_sensor:
+        runtime.add_sensor("sps30", pm_sensor)
+        runtime.add_sink("sps30 file", ["sps30"], pm_writer.write)
+        if cfg.get("aggregate"):
+            runtime.add_sink("sps30 aggregate", ["sps30"], aggregate_sink(pm_sensor))
+        if (cfg.get("quantiles") or {}).get("sps30"):
+            runtime.add_sink("sps30 quantiles", ["sps30"], quantile_sink("sps30", pm_sensor))
+    if co2_sensor:
+        runtime.add_sensor("scd30", co2_sensor)
+        runtime.add_sink("scd30 file", ["scd30"], co2_writer.write)
+        if cfg.get("aggregate"):
+            runtime.add_sink("scd30 aggregate", ["scd30"], aggregate_sink(co2_sensor))
+        if (cfg.get("quantiles") or {}).get("scd30"):
+            runtime.add_sink("scd30 quantiles", ["scd30"], quantile_sink("scd30", co2_sensor))
+    if trackers:
+        runtime.add_periodic("save quantiles", cfg["quantiles"].get("save", 60), save_quantiles)
+    if not cfg.get("aggregate"):
+        runtime.add_periodic("publish", args.frequency, publish)
+    if outbox:
+        runtime.add_periodic("outbox", catch_up_interval, catch_up)
+
+    try:
+        asyncio.run(runtime.run())
+
+    except KeyboardInterrupt:
+        print("Stopping measurement...")
+        print(f"Runtime: {runtime.get_stats()}")
+        save_quantiles()
+        pm_writer.close()
+        co2_writer.close()
+        if archiver:
+            archiver.close()
+            print(f"Archiver: {archiver.get_stats()}")
+        if deadband:
+            print(f"Deadband: {deadband.get_stats()}")
+        if outbox:
+            outbox.close()
+            print(f"Outbox: {outbox.get_stats()}")
+        stop_acquisition(acquisition, sensors)
+        mqtt_connection.disconnect().result()
 
 if __name__ == "__main__":
     main()
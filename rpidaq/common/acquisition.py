@@ -0,0 +1,100 @@
+"""
+Acquisition of all devices on a bus from a single worker thread.
+
+Instead of one sleeping thread per sensor, every device on a bus is polled by
+one worker that keeps a heap of due times and sleeps until the earliest one.
+A device implements poll(), which does one data-ready check or read and
+returns the delay to its next poll. Running several sensors then costs one
+thread and one wakeup per actual poll, and their bus transactions never race
+each other.
+"""
+
+import heapq
+import itertools
+import threading
+from common.clock import Clock
+
+# Delay before polling a device again whose poll() raised, in s
+ERROR_DELAY = 1.0
+
+
+class AcquisitionEngine:
+
+    __engines = {}
+    __engines_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, bus, clock: Clock = None) -> "AcquisitionEngine":
+        """Return the engine serving `bus` (any bus or device handle object), creating it on first use."""
+        with cls.__engines_lock:
+            if bus not in cls.__engines:
+                cls.__engines[bus] = cls(bus, clock)
+            return cls.__engines[bus]
+
+    def __init__(self, bus, clock: Clock = None):
+        self.bus = bus
+        self.clock = clock if clock else Clock()
+        self.thread = None
+        self.wakeups = 0
+        self.__cond = threading.Condition()
+        self.__queue = []
+        self.__devices = set()
+        self.__polling = None
+        self.__seq = itertools.count()
+
+    def add(self, device) -> None:
+        """Start polling `device` now; the worker is started with the first device."""
+        with self.__cond:
+            self.__devices.add(device)
+            heapq.heappush(self.__queue, (self.clock.monotonic(), next(self.__seq), device))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.__run, name="acquisition", daemon=True)
+                self.thread.start()
+            self.__cond.notify()
+
+    def remove(self, device) -> None:
+        """Stop polling `device`; returns once a poll of it in progress has finished."""
+        with self.__cond:
+            self.__devices.discard(device)
+            self.__cond.notify_all()
+            if threading.current_thread() is not self.thread:
+                while self.__polling is device:
+                    self.__cond.wait()
+            if not self.__devices:
+                with self.__engines_lock:
+                    if self.__engines.get(self.bus) is self:
+                        del self.__engines[self.bus]
+
+    def get_stats(self) -> dict:
+        with self.__cond:
+            return {"devices": len(self.__devices), "wakeups": self.wakeups}
+
+    def __run(self) -> None:
+        with self.__cond:
+            while self.__devices:
+                due, _, device = self.__queue[0]
+                if device not in self.__devices:
+                    heapq.heappop(self.__queue)
+                    continue
+                delay = due - self.clock.monotonic()
+                if delay > 0:
+                    # woken early by add()/remove(); the heap is re-checked either way
+                    self.__cond.wait(delay / self.clock.speedup)
+                    continue
+
+                heapq.heappop(self.__queue)
+                self.wakeups += 1
+                self.__polling = device
+                self.__cond.release()
+                try:
+                    delay = device.poll()
+                except Exception as err:
+                    print(f"{type(device).__name__}: {type(err).__name__}: {err}")
+                    delay = ERROR_DELAY
+                finally:
+                    self.__cond.acquire()
+                    self.__polling = None
+                    self.__cond.notify_all()
+                heapq.heappush(self.__queue, (self.clock.monotonic() + delay, next(self.__seq), device))
+            self.__queue.clear()
+            self.thread = None
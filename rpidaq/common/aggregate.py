@@ -0,0 +1,109 @@
+"""
+Streaming window statistics of measurement records.
+
+WindowAggregator keeps count, mean, min, max and standard deviation of every
+channel with Welford's update, so each sample costs O(1) per channel and open
+window, whatever the window length. Windows are aligned to multiples of the
+hop in epoch time: with hop == window (default) they are tumbling, e.g. every
+full minute; with a shorter hop they overlap, e.g. a 10 min window each minute.
+
+A window is emitted as one record once a sample at or after its end arrives.
+The emitted record types are derived from the sensor's record type, so sinks
+format them like raw samples: FIELDS are count, then <field>_mean, _min, _max
+and _std per channel, and the timestamp is the start of the window.
+"""
+
+import math
+from common.records import Record
+
+STATISTICS = ("mean", "min", "max", "std")
+
+_aggregate_records = {}
+
+
+def aggregate_record(record: type) -> type:
+    """Record type of the window statistics of `record` samples (created once per type)."""
+    if record not in _aggregate_records:
+        fields = ("count",) + tuple(f"{field}_{stat}" for field in record.FIELDS for stat in STATISTICS)
+        units = {"count": "1"}
+        units.update({f"{field}_{stat}": unit for field, unit in record.UNITS.items() for stat in STATISTICS})
+        _aggregate_records[record] = type(f"{record.__name__}Aggregate", (Record,), {
+            "__slots__": (),
+            "SENSOR": record.SENSOR,
+            "FIELDS": fields,
+            "UNITS": units
+        })
+    return _aggregate_records[record]
+
+
+class Window:
+
+    __slots__ = ("start", "count", "mean", "m2", "min", "max")
+
+    def __init__(self, start: int, nfields: int):
+        self.start = start
+        self.count = 0
+        self.mean = [0.0] * nfields
+        self.m2 = [0.0] * nfields
+        self.min = [math.inf] * nfields
+        self.max = [-math.inf] * nfields
+
+    def add(self, values: tuple) -> None:
+        self.count += 1
+        n = self.count
+        mean, m2, low, high = self.mean, self.m2, self.min, self.max
+        for i, x in enumerate(values):
+            delta = x - mean[i]
+            mean[i] += delta / n
+            m2[i] += delta * (x - mean[i])
+            if x < low[i]:
+                low[i] = x
+            if x > high[i]:
+                high[i] = x
+
+    def values(self) -> tuple:
+        n = self.count
+        result = [n]
+        for mean, m2, low, high in zip(self.mean, self.m2, self.min, self.max):
+            result.extend((mean, low, high, math.sqrt(m2 / (n - 1)) if n > 1 else 0.0))
+        return tuple(result)
+
+
+class WindowAggregator:
+    """Window statistics of one sensor; `window` and `hop` in s."""
+
+    def __init__(self, record: type, window: float, hop: float = None, callback=None):
+        self.window = window
+        self.hop = hop if hop else window
+        if self.hop > self.window:
+            raise ValueError("hop must not exceed the window")
+        self.callback = callback
+        self.record = aggregate_record(record)
+        self.nfields = len(record.FIELDS)
+        self.__window_ns = int(window * 1e9)
+        self.__hop_ns = int(self.hop * 1e9)
+        self.__open = {}
+
+    def add(self, sample) -> list:
+        """Add one record; returns the windows it completed (also passed to `callback`)."""
+        t = sample.time_ns
+        done = []
+        for start in sorted(self.__open):
+            if start + self.__window_ns > t:
+                break
+            done.append(self.__emit(self.__open.pop(start)))
+
+        start = t - t % self.__hop_ns
+        while start > t - self.__window_ns:
+            window = self.__open.get(start)
+            if window is None:
+                window = self.__open[start] = Window(start, self.nfields)
+            window.add(sample.values)
+            start -= self.__hop_ns
+        return done
+
+    def __emit(self, window: Window):
+        record = self.record(window.start, window.values())
+        if self.callback:
+            self.callback(record)
+        return record
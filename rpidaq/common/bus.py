@@ -0,0 +1,156 @@
+"""
+Shared access to an I2C bus.
+
+All devices on a bus share one file descriptor. Each transaction selects the
+target address, runs under a bus lock and is ordered by priority, so that
+time-critical measurement reads are served ahead of metadata queries.
+"""
+
+import io
+import heapq
+import itertools
+import threading
+from time import monotonic
+from contextlib import contextmanager
+from fcntl import ioctl
+from common.i2c import I2C_SLAVE, PRIORITY_MEASUREMENT, PRIORITY_METADATA, ReceiveBuffers, rdwr_transfer
+
+
+class PriorityLock:
+    """Mutex that hands over to the waiter with the lowest priority value, FIFO within a priority."""
+
+    def __init__(self):
+        self.__cond = threading.Condition()
+        self.__locked = False
+        self.__waiters = []
+        self.__seq = itertools.count()
+
+    def acquire(self, priority: int = PRIORITY_METADATA) -> None:
+        with self.__cond:
+            if not self.__locked and not self.__waiters:
+                self.__locked = True
+                return
+
+            entry = (priority, next(self.__seq))
+            heapq.heappush(self.__waiters, entry)
+            while self.__locked or self.__waiters[0] != entry:
+                self.__cond.wait()
+            heapq.heappop(self.__waiters)
+            self.__locked = True
+
+    def release(self) -> None:
+        with self.__cond:
+            self.__locked = False
+            self.__cond.notify_all()
+
+
+class I2CBus:
+
+    __buses = {}
+    __buses_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, bus: int = 1) -> "I2CBus":
+        """Return the shared manager for /dev/i2c-<bus>, opening it on first use."""
+        with cls.__buses_lock:
+            if bus not in cls.__buses or cls.__buses[bus].closed:
+                cls.__buses[bus] = cls(bus)
+            return cls.__buses[bus]
+
+    def __init__(self, bus: int):
+        self.bus = bus
+        self.fd = io.open("/dev/i2c-"+str(bus), "r+b", buffering=0)
+        self.closed = False
+        self.__lock = PriorityLock()
+        self.__address = None
+        self.__devices = 0
+        self.__stats = {
+            priority: {"transactions": 0, "lock_wait": 0.0, "lock_wait_max": 0.0}
+            for priority in (PRIORITY_MEASUREMENT, PRIORITY_METADATA)
+        }
+        self.__stats_lock = threading.Lock()
+
+    def device(self, address: int) -> "I2CDevice":
+        with self.__stats_lock:
+            self.__devices += 1
+        return I2CDevice(self, address)
+
+    @contextmanager
+    def hold(self, priority: int = PRIORITY_METADATA):
+        t0 = monotonic()
+        self.__lock.acquire(priority)
+        wait = monotonic() - t0
+        with self.__stats_lock:
+            stats = self.__stats.setdefault(priority, {"transactions": 0, "lock_wait": 0.0, "lock_wait_max": 0.0})
+            stats["transactions"] += 1
+            stats["lock_wait"] += wait
+            stats["lock_wait_max"] = max(stats["lock_wait_max"], wait)
+        try:
+            yield
+        finally:
+            self.__lock.release()
+
+    def write(self, address: int, data: list, priority: int = PRIORITY_METADATA) -> None:
+        with self.hold(priority):
+            self.__select(address)
+            self.fd.write(bytearray(data))
+
+    def read(self, address: int, buffer: memoryview, priority: int = PRIORITY_METADATA) -> memoryview:
+        with self.hold(priority):
+            self.__select(address)
+            self.fd.readinto(buffer)
+            return buffer
+
+    def transfer(self, address: int, data: list, buffer: memoryview, delay: float = 0,
+                 priority: int = PRIORITY_METADATA) -> memoryview:
+        # I2C_RDWR messages carry their own address, no I2C_SLAVE needed
+        with self.hold(priority):
+            return rdwr_transfer(self.fd, address, data, buffer, delay)
+
+    def get_stats(self) -> dict:
+        """Transactions and lock-wait time (total/max, in s) per priority."""
+        with self.__stats_lock:
+            return {priority: dict(stats) for priority, stats in self.__stats.items()}
+
+    def release(self) -> None:
+        """Drop one device reference; the fd is closed with the last device."""
+        with self.__stats_lock:
+            self.__devices -= 1
+            last = self.__devices <= 0
+        if last:
+            self.close()
+
+    def close(self) -> None:
+        with self.hold(PRIORITY_METADATA):
+            self.closed = True
+            self.fd.close()
+
+    def __select(self, address: int) -> None:
+        # only called with the bus lock held
+        if address != self.__address:
+            ioctl(self.fd, I2C_SLAVE, address)
+            self.__address = address
+
+
+class I2CDevice:
+    """Handle for one address on a shared bus, with the same interface as common.i2c.I2C."""
+
+    def __init__(self, bus: I2CBus, address: int):
+        self.bus = bus
+        self.address = address
+        self.buffers = ReceiveBuffers()
+        self.__closed = False
+
+    def write(self, data: list, priority: int = PRIORITY_METADATA) -> None:
+        self.bus.write(self.address, data, priority)
+
+    def read(self, nbytes: int, priority: int = PRIORITY_METADATA) -> memoryview:
+        return self.bus.read(self.address, self.buffers.get(priority, nbytes), priority)
+
+    def transfer(self, data: list, nbytes: int, delay: float = 0, priority: int = PRIORITY_METADATA) -> memoryview:
+        return self.bus.transfer(self.address, data, self.buffers.get(priority, nbytes), delay, priority)
+
+    def close(self) -> None:
+        if not self.__closed:
+            self.__closed = True
+            self.bus.release()
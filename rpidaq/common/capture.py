@@ -0,0 +1,98 @@
+"""
+Raw-frame capture of measured-values responses.
+
+In capture mode a driver appends every CRC-framed response as it came off the
+bus, prefixed with an 8-byte timestamp, and does no decoding while acquiring.
+Frames are only CRC-checked and decoded when read: from the file, or live when
+a consumer asks the driver for them (get_measurement, drain, subscribers), so
+the acquisition path stays cheap and the archive remains bit-exact for
+re-decoding. Like the other file sinks (common.writer.FileWriter), the writer
+flushes its buffer every `flush_interval` s and syncs the file to the SD card
+every `fsync_interval` s and on close, so a power cut loses at most the last
+`fsync_interval` s of frames; a partial entry left at the end is cut off before
+appending.
+
+File layout (little-endian):
+    header  magic (8s), frame size (H), struct format (16s), record type (32s)
+    entry   timestamp in ns since epoch (q), frame (frame size bytes)
+"""
+
+import os
+import mmap
+import struct
+from common.clock import Clock
+from common.decode import FrameDecoder
+from common.writer import FileWriter
+
+MAGIC = b"RPIDAQ\x00\x01"
+HEADER = struct.Struct("<8sH16s32s")
+TIMESTAMP = struct.Struct("<q")
+
+
+class CaptureWriter(FileWriter):
+
+    def __init__(self, path: str, fmt: str, record: type, flush_interval: float = 5.0, fsync_interval: float = 60.0,
+                 clock: Clock = None):
+        super().__init__(False, flush_interval, fsync_interval, clock=clock)
+        self.decoder = FrameDecoder(fmt)
+        self.frame_size = self.decoder.nbytes
+        self.header = HEADER.pack(MAGIC, self.frame_size, fmt.encode("ascii"), record.__name__.encode("ascii"))
+        self.path = os.path.expanduser(path)
+
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            with open(self.path, "rb") as fh:
+                if fh.read(HEADER.size) != self.header:
+                    raise ValueError(f"{self.path} holds frames of a different format")
+
+    def append(self, timestamp_ns: int, frame) -> None:
+        super().append(timestamp_ns, TIMESTAMP.pack(timestamp_ns), frame)
+
+    def filename(self, day_ns: int) -> str:
+        return self.path
+
+    def opened(self, fh, new: bool) -> None:
+        if new:
+            fh.write(self.header)
+            return
+        # drop a partial entry left by a power cut, so entries stay aligned
+        torn = (fh.tell() - HEADER.size) % (TIMESTAMP.size + self.frame_size)
+        if torn:
+            fh.truncate(fh.tell() - torn)
+
+
+class CaptureReader:
+    """Memory-mapped reader of a capture file; `records` maps record type names to classes."""
+
+    def __init__(self, path: str, records: dict):
+        self.path = os.path.expanduser(path)
+        with open(self.path, "rb") as fh:
+            self.__mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.frame_size, fmt, name = HEADER.unpack_from(self.__mm)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a capture file")
+        self.decoder = FrameDecoder(fmt.rstrip(b"\0").decode("ascii"))
+        self.record = records[name.rstrip(b"\0").decode("ascii")]
+        self.entry_size = TIMESTAMP.size + self.frame_size
+        self.bad_frames = 0
+
+    def __len__(self) -> int:
+        return (len(self.__mm) - HEADER.size) // self.entry_size
+
+    def frames(self):
+        """Yield (timestamp_ns, frame) with frame as a memoryview into the file, no copies."""
+        view = memoryview(self.__mm)
+        for offset in range(HEADER.size, HEADER.size + len(self) * self.entry_size, self.entry_size):
+            yield TIMESTAMP.unpack_from(view, offset)[0], view[offset+TIMESTAMP.size:offset+self.entry_size]
+
+    def records(self):
+        """Decode lazily; frames failing their CRC are skipped and counted in `bad_frames`."""
+        for timestamp_ns, frame in self.frames():
+            bad, values = self.decoder.decode(frame)
+            if bad:
+                self.bad_frames += 1
+                continue
+            yield self.record(timestamp_ns, values)
+
+    def close(self) -> None:
+        self.__mm.close()
@@ -1,18 +1,55 @@
+"""
+Sensirion CRC-8 (polynomial 0x31, init 0xFF), computed with a lookup table.
+
+Responses are sequences of [data1, data2, crc] words; validate_frame() checks
+all of them in one pass and strips the checksum bytes.
+"""
+
+POLYNOMIAL = 0x31
+INIT = 0xFF
+
+
+def _table() -> bytes:
+    table = bytearray(256)
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            if crc & 0x80:
+                crc = (crc << 1) ^ POLYNOMIAL
+            else:
+                crc = crc << 1
+        # The checksum only contains 8-bit
+        table[byte] = crc & 0xFF
+    return bytes(table)
+
+
+TABLE = _table()
+
+
 class CRC:
     def __init__(self):
         return
 
-    def calc(self, data: list) -> int:
-        crc = 0xFF
-        for i in range(2):
-            crc ^= data[i]
-            for _ in range(8, 0, -1):
-                if crc & 0x80:
-                    crc = (crc << 1) ^ 0x31
-                else:
-                    crc = crc << 1
+    def calc(self, data) -> int:
+        """CRC of one 2-byte word."""
+        return TABLE[TABLE[INIT ^ data[0]] ^ data[1]]
+
+    def validate_frame(self, buf) -> tuple:
+        """Check every 3-byte word of a response.
 
-        # The checksum only contains 8-bit,
-        # so the calculated value has to be masked with 0xFF
-        return (crc & 0x0000FF)
+        Returns (bad, payload): bit i of `bad` is set if word i failed its CRC
+        (0 means the whole frame is valid), and `payload` holds the data bytes
+        of all words with the checksums removed.
+        """
+        table = TABLE
+        bad = 0
+        bit = 1
+        for data1, data2, crc in zip(buf[0::3], buf[1::3], buf[2::3]):
+            if table[table[INIT ^ data1] ^ data2] != crc:
+                bad |= bit
+            bit <<= 1
 
+        payload = bytearray(2 * (len(buf) // 3))
+        payload[0::2] = buf[0::3]
+        payload[1::2] = buf[1::3]
+        return bad, payload
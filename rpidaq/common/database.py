@@ -0,0 +1,96 @@
+"""
+SQLite sink for measurement records.
+
+Each record type gets a table named after it (e.g. SPS30Record,
+SCD30RecordAggregate) with columns sensor, timestamp (epoch ns) and one REAL
+column per field, indexed on (sensor, timestamp); the table `records` keeps
+the schema with the units of every table. The database runs in WAL mode with
+synchronous=NORMAL, and rows are inserted in one transaction per
+`batch_size` samples or `batch_interval` s, so the flash sees a few page
+writes per batch instead of a journal round trip per sample.
+
+Same interface as CSVWriter: write(record), flush(), close().
+"""
+
+import os
+import json
+import sqlite3
+import threading
+from common.clock import Clock
+
+
+def quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+class SQLiteWriter:
+
+    def __init__(self, path: str, batch_size: int = 100, batch_interval: float = 10.0, clock: Clock = None):
+        self.path = os.path.expanduser(path)
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.clock = clock if clock else Clock()
+        self.rows = 0
+        self.transactions = 0
+        self.__pending = {}
+        self.__count = 0
+        self.__inserts = {}
+        self.__last_commit = self.clock.monotonic()
+        self.__lock = threading.Lock()
+
+        # sinks are called from the runtime's worker threads; access is serialized by the lock
+        self.__connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.__connection.execute("PRAGMA journal_mode=WAL")
+        self.__connection.execute("PRAGMA synchronous=NORMAL")
+        with self.__connection:
+            self.__connection.execute("CREATE TABLE IF NOT EXISTS records (name TEXT PRIMARY KEY, schema TEXT)")
+
+    def write(self, record) -> None:
+        with self.__lock:
+            insert = self.__inserts.get(type(record))
+            if insert is None:
+                insert = self.__inserts[type(record)] = self.__create(type(record))
+            self.__pending.setdefault(insert, []).append((record.SENSOR, record.time_ns, *record.values))
+            self.__count += 1
+
+            now = self.clock.monotonic()
+            if self.__count >= self.batch_size or now - self.__last_commit >= self.batch_interval:
+                self.__commit(now)
+
+    def flush(self) -> None:
+        with self.__lock:
+            self.__commit(self.clock.monotonic())
+
+    def close(self) -> None:
+        with self.__lock:
+            if self.__connection:
+                self.__commit(self.clock.monotonic())
+                self.__connection.close()
+                self.__connection = None
+
+    def get_stats(self) -> dict:
+        return {"rows": self.rows, "transactions": self.transactions, "pending": self.__count}
+
+    def __commit(self, now: float) -> None:
+        self.__last_commit = now
+        if not self.__count:
+            return
+        with self.__connection:
+            for insert, rows in self.__pending.items():
+                self.__connection.executemany(insert, rows)
+        self.rows += self.__count
+        self.transactions += 1
+        self.__pending = {}
+        self.__count = 0
+
+    def __create(self, record: type) -> str:
+        table = quote(record.__name__)
+        columns = ", ".join(f"{quote(field)} REAL" for field in record.FIELDS)
+        with self.__connection:
+            self.__connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} (sensor TEXT NOT NULL, timestamp INTEGER NOT NULL, {columns})")
+            self.__connection.execute(
+                f"CREATE INDEX IF NOT EXISTS {quote(record.__name__ + '_sensor_timestamp')} ON {table} (sensor, timestamp)")
+            self.__connection.execute("INSERT OR REPLACE INTO records VALUES (?, ?)",
+                                      (record.__name__, json.dumps(record.schema())))
+        return f"INSERT INTO {table} VALUES (?, ?{', ?' * len(record.FIELDS)})"
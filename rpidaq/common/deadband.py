@@ -0,0 +1,72 @@
+"""
+Change-driven publishing.
+
+A message is only worth sending if some value moved by more than its deadband
+since the last message that was actually published, or if the heartbeat
+interval has passed (so the receiver can tell a quiet sensor from a dead
+link). The deadband of a field is max(absolute, relative * |last published
+value|): the absolute part keeps noise around zero quiet, the relative part
+scales with the level.
+"""
+
+import threading
+
+
+class Deadband:
+    """`absolute` maps fields to bands in their unit; `relative` is a fraction, for all fields or by field.
+
+    Only fields with a band are compared; `heartbeat` is in s.
+    """
+
+    def __init__(self, absolute: dict = None, relative=None, heartbeat: float = 900):
+        self.absolute = absolute if absolute else {}
+        self.relative = relative if relative else {}
+        self.heartbeat = heartbeat
+        self.checked = 0
+        self.published = 0
+        self.heartbeats = 0
+        self.__last = {}
+        self.__last_time = None
+        self.__lock = threading.Lock()
+
+    def band(self, field: str, last: float) -> float:
+        relative = self.relative if isinstance(self.relative, (int, float)) else self.relative.get(field)
+        absolute = self.absolute.get(field)
+        if absolute is None and relative is None:
+            return None
+        return max(absolute or 0.0, (relative or 0.0) * abs(last))
+
+    def check(self, data: dict, now: float) -> bool:
+        """True if `data` should be published at time `now` (s)."""
+        with self.__lock:
+            self.checked += 1
+            if self.__last_time is None:
+                return True
+            if now - self.__last_time >= self.heartbeat:
+                self.heartbeats += 1
+                return True
+            for field, value in data.items():
+                last = self.__last.get(field)
+                if not isinstance(value, (int, float)) or last is None:
+                    continue
+                band = self.band(field, last)
+                if band is not None and abs(value - last) > band:
+                    return True
+            return False
+
+    def commit(self, data: dict, now: float) -> None:
+        """Record `data` as published at time `now`; the next checks compare against it."""
+        with self.__lock:
+            self.published += 1
+            self.__last_time = now
+            self.__last = {field: value for field, value in data.items() if isinstance(value, (int, float))}
+
+    def get_stats(self) -> dict:
+        with self.__lock:
+            return {
+                "checked": self.checked,
+                "published": self.published,
+                "suppressed": self.checked - self.published,
+                "heartbeats": self.heartbeats,
+                "suppression_ratio": (self.checked - self.published) / self.checked if self.checked else None
+            }
@@ -0,0 +1,28 @@
+"""
+Decoding of Sensirion measured-values responses.
+
+A response is CRC-checked and stripped in one pass (common.crc), then the
+payload is unpacked with a single precompiled struct, e.g. '>10f' for the
+SPS30 float format. Values keep full precision; rounding is left to the
+output side (common.records).
+"""
+
+import struct
+from common.crc import CRC
+
+
+class FrameDecoder:
+
+    def __init__(self, fmt: str):
+        self.layout = struct.Struct(fmt)
+        self.crc = CRC()
+        # response length on the bus: one CRC byte per 2-byte word
+        self.nbytes = self.layout.size // 2 * 3
+
+    def decode(self, data) -> tuple:
+        """Return (bad, values): the CRC mask of common.crc.CRC.validate_frame, and the unpacked tuple (None if bad)."""
+        bad, payload = self.crc.validate_frame(data)
+        if bad:
+            return bad, None
+        return bad, self.layout.unpack(payload)
+
@@ -0,0 +1,89 @@
+"""
+Push delivery of samples to subscribed callbacks.
+
+The acquisition worker hands each validated sample to publish(), which only
+queues it for a small executor and returns; the callbacks (file writers,
+publishers) run there. At most `max_pending` samples wait for delivery. Beyond
+that, new samples are dropped and counted instead of blocking the I2C loop
+behind a slow sink.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Dispatcher:
+    """Calls every subscriber with each published item, in order with the default single worker."""
+
+    def __init__(self, max_workers: int = 1, max_pending: int = 100, logger: str = None):
+        self.logger = None
+        if logger:
+            self.logger = logging.getLogger(logger)
+
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.subscribers = []
+        self.delivered = 0
+        self.dropped = 0
+        self.errors = 0
+        self.__pending = threading.BoundedSemaphore(max_pending)
+        self.__lock = threading.Lock()
+        self.__executor = None
+
+    def subscribe(self, callback) -> None:
+        with self.__lock:
+            self.subscribers = self.subscribers + [callback]
+            if self.__executor is None:
+                self.__executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="dispatch")
+
+    def unsubscribe(self, callback) -> None:
+        with self.__lock:
+            self.subscribers = [subscriber for subscriber in self.subscribers if subscriber != callback]
+
+    def publish(self, item) -> bool:
+        """Queue `item` for the subscribers without blocking; False if it was dropped."""
+        executor, subscribers = self.__executor, self.subscribers
+        if executor is None or not subscribers:
+            return False
+        if not self.__pending.acquire(blocking=False):
+            with self.__lock:
+                self.dropped += 1
+            return False
+        try:
+            executor.submit(self.__deliver, subscribers, item)
+        except RuntimeError:
+            # executor shut down
+            self.__pending.release()
+            return False
+        return True
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop accepting items; with `wait`, return after the pending ones were delivered."""
+        with self.__lock:
+            executor, self.__executor = self.__executor, None
+            self.subscribers = []
+        if executor:
+            executor.shutdown(wait=wait)
+
+    def get_stats(self) -> dict:
+        with self.__lock:
+            return {"subscribers": len(self.subscribers), "delivered": self.delivered,
+                    "dropped": self.dropped, "errors": self.errors}
+
+    def __deliver(self, subscribers: list, item) -> None:
+        try:
+            for callback in subscribers:
+                try:
+                    callback(item)
+                except Exception as err:
+                    with self.__lock:
+                        self.errors += 1
+                    if self.logger:
+                        self.logger.warning(f"{getattr(callback, '__name__', callback)}: {type(err).__name__}: {err}")
+                    else:
+                        print(f"{getattr(callback, '__name__', callback)}: {type(err).__name__}: {err}")
+            with self.__lock:
+                self.delivered += 1
+        finally:
+            self.__pending.release()
@@ -0,0 +1,315 @@
+"""
+In-memory emulation of the SPS30 and SCD30 I2C interfaces.
+
+EmulatedBus stands in for common.bus.I2CBus: its device handles offer the same
+write/read/transfer/close interface as common.i2c.I2C, and the attached device
+models answer the Sensirion command sets with CRC-8 framed responses. Combined
+with common.clock.VirtualClock, drivers and applications can be benchmarked
+and soak-tested on any Linux box, with time running many times faster than
+real time.
+"""
+
+import errno
+import math
+import random
+import struct
+import threading
+from common.clock import Clock
+from common.crc import CRC
+from common.i2c import PRIORITY_METADATA, ReceiveBuffers
+
+SPS30_ADDRESS = 0x69
+SCD30_ADDRESS = 0x61
+
+SECONDS_PER_DAY = 86400
+
+
+def _nack(message: str) -> OSError:
+    # what the kernel reports when the device does not acknowledge
+    return OSError(errno.EREMOTEIO, message)
+
+
+class SensirionEmulator:
+    """Command/response state machine shared by the Sensirion device models.
+
+    A write selects the response to the next read. Subclasses register one
+    handler per 16-bit command; a handler receives the argument words (CRC
+    checked) and returns the response payload, or None for commands without
+    response.
+    """
+
+    def __init__(self, clock: Clock = None, crc_error_rate: float = 0.0, seed: int = None):
+        self.clock = clock if clock else Clock()
+        self.crc_error_rate = crc_error_rate
+        self.random = random.Random(seed)
+        self.crc = CRC()
+        self.commands = {}
+        self.__response = b""
+
+    def write(self, data: bytes) -> None:
+        if len(data) < 2:
+            raise _nack("command too short")
+        command = data[0] << 8 | data[1]
+        if command not in self.commands:
+            raise _nack(f"unknown command 0x{command:04X}")
+
+        args = bytearray()
+        for i in range(2, len(data) - 2, 3):
+            if self.crc.calc(data[i:i+2]) != data[i+2]:
+                raise _nack(f"argument CRC mismatch for command 0x{command:04X}")
+            args.extend(data[i:i+2])
+
+        payload = self.commands[command](bytes(args))
+        self.__response = self.frame(payload) if payload is not None else b""
+
+    def read(self, nbytes: int) -> bytes:
+        if not self.__response:
+            raise _nack("no response pending")
+        response = self.__response[:nbytes]
+        return response + bytes(nbytes - len(response))
+
+    def frame(self, payload: bytes) -> bytes:
+        """Interleave a CRC byte after every 2-byte word, corrupting some at `crc_error_rate`."""
+        out = bytearray()
+        for i in range(0, len(payload), 2):
+            word = payload[i:i+2]
+            crc = self.crc.calc(word)
+            if self.crc_error_rate and self.random.random() < self.crc_error_rate:
+                crc ^= 0xFF
+            out.extend(word)
+            out.append(crc)
+        return bytes(out)
+
+    def daily_cycle(self, phase: float = 0.0) -> float:
+        """Smooth diurnal signal in [-1, 1] at the current clock time."""
+        return math.sin(2 * math.pi * (self.clock.time() / SECONDS_PER_DAY + phase))
+
+
+class SPS30Emulator(SensirionEmulator):
+    """SPS30 particulate matter sensor, producing a new sample every `data_ready_interval` seconds."""
+
+    def __init__(self, data_ready_interval: float = 1.0, serial_number: str = "EMULATED0000SPS30",
+                 firmware_version: tuple = (2, 3), **kwargs):
+        super().__init__(**kwargs)
+        self.data_ready_interval = data_ready_interval
+        self.serial_number = serial_number
+        self.firmware_version = firmware_version
+        self.auto_cleaning_interval = 604800
+        self.status_register = 0
+        self.output_format = None
+        self.__started = None
+        self.__last_read = 0
+        self.commands = {
+            0x0010: self.__start_measurement,
+            0x0104: self.__stop_measurement,
+            0x0202: self.__get_data_ready_flag,
+            0x0300: self.__get_measured_values,
+            0x1001: self.__no_response,  # sleep
+            0x1103: self.__no_response,  # wake-up
+            0x5607: self.__no_response,  # start fan cleaning
+            0x8004: self.__auto_cleaning_interval,
+            0xD002: self.__get_product_type,
+            0xD033: self.__get_serial_number,
+            0xD100: self.__get_firmware_version,
+            0xD206: self.__get_status_register,
+            0xD210: self.__clear_status_register,
+            0xD304: self.__reset,
+        }
+
+    def __no_response(self, args: bytes) -> None:
+        return None
+
+    def __sample_index(self) -> int:
+        return int((self.clock.monotonic() - self.__started) // self.data_ready_interval)
+
+    def __start_measurement(self, args: bytes) -> None:
+        if len(args) != 2 or args[0] not in (0x03, 0x05):
+            raise _nack("invalid output format")
+        self.output_format = args[0]
+        self.__started = self.clock.monotonic()
+        self.__last_read = 0
+
+    def __stop_measurement(self, args: bytes) -> None:
+        self.__started = None
+
+    def __get_data_ready_flag(self, args: bytes) -> bytes:
+        ready = self.__started is not None and self.__sample_index() > self.__last_read
+        return bytes([0x00, 0x01 if ready else 0x00])
+
+    def __get_measured_values(self, args: bytes) -> bytes:
+        if self.__started is None:
+            raise _nack("not measuring")
+        self.__last_read = self.__sample_index()
+
+        pm = max(0.5, 8.0 + 4.0 * self.daily_cycle() + self.random.gauss(0.0, 0.5))
+        mass_density = [0.55 * pm, pm, 1.2 * pm, 1.3 * pm]
+        particle_count = [8.0 * pm, 9.5 * pm, 9.9 * pm, 10.0 * pm, 10.05 * pm]
+        particle_size = 0.6 + 0.1 * self.daily_cycle(0.25)
+
+        if self.output_format == 0x05:
+            values = [round(x) for x in mass_density + particle_count] + [round(particle_size * 1000)]
+            return struct.pack(">10H", *values)
+        return struct.pack(">10f", *mass_density, *particle_count, particle_size)
+
+    def __auto_cleaning_interval(self, args: bytes) -> bytes:
+        if args:
+            self.auto_cleaning_interval = struct.unpack(">I", args)[0]
+            return None
+        return struct.pack(">I", self.auto_cleaning_interval)
+
+    def __get_product_type(self, args: bytes) -> bytes:
+        return b"00080000"
+
+    def __get_serial_number(self, args: bytes) -> bytes:
+        return self.serial_number.encode("ascii")[:31].ljust(32, b"\0")
+
+    def __get_firmware_version(self, args: bytes) -> bytes:
+        return bytes(self.firmware_version)
+
+    def __get_status_register(self, args: bytes) -> bytes:
+        return struct.pack(">I", self.status_register)
+
+    def __clear_status_register(self, args: bytes) -> None:
+        self.status_register = 0
+
+    def __reset(self, args: bytes) -> None:
+        self.__started = None
+        self.status_register = 0
+
+
+class SCD30Emulator(SensirionEmulator):
+    """SCD30 CO2/T/RH sensor, producing a new sample every `data_ready_interval` seconds."""
+
+    def __init__(self, data_ready_interval: float = 2.0, firmware_version: tuple = (3, 66), **kwargs):
+        super().__init__(**kwargs)
+        self.data_ready_interval = data_ready_interval
+        self.firmware_version = firmware_version
+        self.pressure = 0
+        self.altitude = 0
+        self.__started = None
+        self.__last_read = 0
+        self.commands = {
+            0x0010: self.__start_measurement,
+            0x0104: self.__stop_measurement,
+            0x0202: self.__get_data_ready_flag,
+            0x0300: self.__get_measured_values,
+            0x5102: self.__set_altitude,
+            0xD100: self.__get_firmware_version,
+            0xD304: self.__reset,
+        }
+
+    def __sample_index(self) -> int:
+        return int((self.clock.monotonic() - self.__started) // self.data_ready_interval)
+
+    def __start_measurement(self, args: bytes) -> None:
+        if len(args) != 2:
+            raise _nack("missing pressure argument")
+        self.pressure = struct.unpack(">H", args)[0]
+        self.__started = self.clock.monotonic()
+        self.__last_read = 0
+
+    def __stop_measurement(self, args: bytes) -> None:
+        self.__started = None
+
+    def __get_data_ready_flag(self, args: bytes) -> bytes:
+        ready = self.__started is not None and self.__sample_index() > self.__last_read
+        return bytes([0x00, 0x01 if ready else 0x00])
+
+    def __get_measured_values(self, args: bytes) -> bytes:
+        if self.__started is None:
+            raise _nack("not measuring")
+        self.__last_read = self.__sample_index()
+
+        co2 = 420.0 + 300.0 * max(0.0, self.daily_cycle()) + self.random.gauss(0.0, 5.0)
+        t = 22.0 + 2.0 * self.daily_cycle(-0.1) + self.random.gauss(0.0, 0.05)
+        rh = 45.0 - 5.0 * self.daily_cycle(-0.1) + self.random.gauss(0.0, 0.2)
+        return struct.pack(">3f", co2, t, rh)
+
+    def __set_altitude(self, args: bytes) -> None:
+        self.altitude = struct.unpack(">H", args)[0]
+
+    def __get_firmware_version(self, args: bytes) -> bytes:
+        return bytes(self.firmware_version)
+
+    def __reset(self, args: bytes) -> None:
+        self.__started = None
+
+
+class EmulatedBus:
+    """Stand-in for common.bus.I2CBus with emulated devices attached by address."""
+
+    def __init__(self, clock: Clock = None):
+        self.clock = clock if clock else Clock()
+        self.devices = {}
+        self.__lock = threading.Lock()
+        self.__transactions = 0
+
+    def attach(self, address: int, device: SensirionEmulator) -> SensirionEmulator:
+        self.devices[address] = device
+        return device
+
+    def device(self, address: int) -> "EmulatedDevice":
+        return EmulatedDevice(self, address)
+
+    def write(self, address: int, data: list, priority: int = PRIORITY_METADATA) -> None:
+        with self.__lock:
+            self.__transactions += 1
+            self.__target(address).write(bytes(data))
+
+    def read(self, address: int, buffer: memoryview, priority: int = PRIORITY_METADATA) -> memoryview:
+        with self.__lock:
+            self.__transactions += 1
+            buffer[:] = self.__target(address).read(len(buffer))
+            return buffer
+
+    def transfer(self, address: int, data: list, buffer: memoryview, delay: float = 0,
+                 priority: int = PRIORITY_METADATA) -> memoryview:
+        with self.__lock:
+            self.__transactions += 1
+            device = self.__target(address)
+            device.write(bytes(data))
+            self.clock.sleep(delay)
+            buffer[:] = device.read(len(buffer))
+            return buffer
+
+    def get_stats(self) -> dict:
+        return {"transactions": self.__transactions}
+
+    def release(self) -> None:
+        pass
+
+    def __target(self, address: int) -> SensirionEmulator:
+        if address not in self.devices:
+            raise _nack(f"no device at 0x{address:02X}")
+        return self.devices[address]
+
+
+class EmulatedDevice:
+    """Device handle on an EmulatedBus, interchangeable with common.i2c.I2C and common.bus.I2CDevice."""
+
+    def __init__(self, bus: EmulatedBus, address: int):
+        self.bus = bus
+        self.address = address
+        self.buffers = ReceiveBuffers()
+
+    def write(self, data: list, priority: int = PRIORITY_METADATA) -> None:
+        self.bus.write(self.address, data, priority)
+
+    def read(self, nbytes: int, priority: int = PRIORITY_METADATA) -> memoryview:
+        return self.bus.read(self.address, self.buffers.get(priority, nbytes), priority)
+
+    def transfer(self, data: list, nbytes: int, delay: float = 0, priority: int = PRIORITY_METADATA) -> memoryview:
+        return self.bus.transfer(self.address, data, self.buffers.get(priority, nbytes), delay, priority)
+
+    def close(self) -> None:
+        self.bus.release()
+
+
+def emulated_bus(clock: Clock = None, sps30: bool = True, scd30: bool = True, **kwargs) -> EmulatedBus:
+    """EmulatedBus with an SPS30 and/or SCD30 at their default addresses; kwargs go to both models."""
+    bus = EmulatedBus(clock)
+    if sps30:
+        bus.attach(SPS30_ADDRESS, SPS30Emulator(clock=bus.clock, **kwargs))
+    if scd30:
+        bus.attach(SCD30_ADDRESS, SCD30Emulator(clock=bus.clock, **kwargs))
+    return bus
@@ -25,28 +25,111 @@ SOFTWARE.
 """
 
 import io
+import ctypes
 from fcntl import ioctl
+from time import sleep
 
 I2C_SLAVE = 0x0703
+I2C_RDWR = 0x0707
+
+# i2c_msg flags
+I2C_M_RD = 0x0001
+
+# Transaction priorities, lower is served first (see common.bus)
+PRIORITY_MEASUREMENT = 0
+PRIORITY_METADATA = 1
+
+# Size of the preallocated receive buffers, large enough for any SPS30/SCD30 response
+BUFFER_SIZE = 64
+
+
+class i2c_msg(ctypes.Structure):
+    _fields_ = [
+        ("addr", ctypes.c_uint16),
+        ("flags", ctypes.c_uint16),
+        ("len", ctypes.c_uint16),
+        ("buf", ctypes.POINTER(ctypes.c_uint8))
+    ]
+
+
+class i2c_rdwr_ioctl_data(ctypes.Structure):
+    _fields_ = [
+        ("msgs", ctypes.POINTER(i2c_msg)),
+        ("nmsgs", ctypes.c_uint32)
+    ]
+
+
+def rdwr_transfer(fd, address: int, data: list, buffer: memoryview, delay: float = 0) -> memoryview:
+    """Write a command and read its response into `buffer` using I2C_RDWR.
+
+    Without delay, both messages go out in a single ioctl (repeated start),
+    so no other transaction can get in between. Devices that need time to
+    prepare the response (or do not support repeated start) get two
+    I2C_RDWR calls on the same fd, separated by `delay` seconds.
+    """
+    wbuf = (ctypes.c_uint8 * len(data))(*data)
+    rbuf = (ctypes.c_uint8 * len(buffer)).from_buffer(buffer)
+    msgs = (i2c_msg * 2)(
+        i2c_msg(address, 0, len(data), wbuf),
+        i2c_msg(address, I2C_M_RD, len(buffer), rbuf))
+
+    if delay:
+        _rdwr(fd, msgs, 0, 1)
+        sleep(delay)
+        _rdwr(fd, msgs, 1, 1)
+    else:
+        _rdwr(fd, msgs, 0, 2)
+
+    return buffer
+
+
+def _rdwr(fd, msgs, first: int, nmsgs: int):
+    ptr = ctypes.cast(ctypes.byref(msgs, first * ctypes.sizeof(i2c_msg)), ctypes.POINTER(i2c_msg))
+    ioctl(fd, I2C_RDWR, i2c_rdwr_ioctl_data(ptr, nmsgs))
+
+
+class ReceiveBuffers:
+    """Preallocated per-device receive buffers.
+
+    Reads return a memoryview into these buffers instead of a fresh list, and
+    the view is only valid until the next read of the same priority on the
+    same device. Measurement reads (issued by the acquisition thread only)
+    and metadata queries (issued from anywhere) use separate buffers, so a
+    metadata query cannot overwrite a frame that is still being decoded.
+    """
+
+    def __init__(self, size: int = BUFFER_SIZE):
+        self.__measurement = memoryview(bytearray(size))
+        self.__metadata = memoryview(bytearray(size))
+
+    def get(self, priority: int, nbytes: int) -> memoryview:
+        return (self.__measurement if priority == PRIORITY_MEASUREMENT else self.__metadata)[:nbytes]
 
 
 class I2C:
 
     def __init__(self, bus: int, address: int):
 
-        self.fr = io.open("/dev/i2c-"+str(bus), "rb", buffering=0)
-        self.fw = io.open("/dev/i2c-"+str(bus), "wb", buffering=0)
+        self.address = address
+        self.fd = io.open("/dev/i2c-"+str(bus), "r+b", buffering=0)
+
+        # set device address for plain read()/write()
+        ioctl(self.fd, I2C_SLAVE, address)
+
+        self.buffers = ReceiveBuffers()
 
-        # set device address
-        ioctl(self.fr, I2C_SLAVE, address)
-        ioctl(self.fw, I2C_SLAVE, address)
+    # 'priority' is accepted for compatibility with common.bus.I2CDevice;
+    # a private handle has nobody to queue behind.
+    def write(self, data: list, priority: int = None):
+        self.fd.write(bytearray(data))
 
-    def write(self, data: list):
-        self.fw.write(bytearray(data))
+    def read(self, nbytes: int, priority: int = None) -> memoryview:
+        view = self.buffers.get(priority, nbytes)
+        self.fd.readinto(view)
+        return view
 
-    def read(self, nbytes: int) -> list:
-        return list(self.fr.read(nbytes))
+    def transfer(self, data: list, nbytes: int, delay: float = 0, priority: int = None) -> memoryview:
+        return rdwr_transfer(self.fd, self.address, data, self.buffers.get(priority, nbytes), delay)
 
     def close(self):
-        self.fw.close()
-        self.fr.close()
\ No newline at end of file
+        self.fd.close()
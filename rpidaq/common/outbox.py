@@ -0,0 +1,177 @@
+"""
+Durable store-and-forward queue of outgoing messages.
+
+Every message is appended to the current segment file (<first id>.seg in the
+outbox directory) and synced before it is published, as an entry of id,
+length and CRC-32 followed by the payload. When the broker acknowledges it
+(PUBACK), its id is appended to the segment's <first id>.ack file; a segment
+whose entries are all acknowledged is deleted. Unacknowledged entries survive
+restarts and are handed out again by pending() for replay, oldest first. Only
+the ids and file offsets of pending entries are kept in memory.
+
+Disk usage is bounded by `max_bytes`: when exceeded, the oldest segments are
+deleted with whatever they still hold, and the lost entries are counted as
+evicted. An acknowledgement lost with a crash only leads to the message being
+sent twice (MQTT QoS 1 is at-least-once anyway).
+"""
+
+import os
+import re
+import zlib
+import struct
+import threading
+from collections import OrderedDict
+
+# id, payload length, CRC-32 of the payload
+ENTRY = struct.Struct("<QII")
+ACK = struct.Struct("<Q")
+
+
+class Outbox:
+
+    def __init__(self, directory: str, segment_size: int = 1 << 20, max_bytes: int = 64 << 20, fsync: bool = True):
+        self.directory = os.path.expanduser(directory)
+        self.segment_size = segment_size
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.written = 0
+        self.acked = 0
+        self.evicted = 0
+        # segment -> [size, unacked entries]; id -> (segment, offset, length) of unacked entries
+        self.__segments = OrderedDict()
+        self.__pending = OrderedDict()
+        self.__next_id = 1
+        self.__fh = None
+        self.__lock = threading.Lock()
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.__load()
+
+    def put(self, payload: bytes) -> int:
+        """Store `payload` durably; returns its id, to be passed to ack() once delivered."""
+        with self.__lock:
+            if self.__fh is None or self.__segments[self.__active][0] >= self.segment_size:
+                self.__roll()
+            entry_id = self.__next_id
+            self.__next_id += 1
+            offset = self.__segments[self.__active][0]
+            self.__fh.write(ENTRY.pack(entry_id, len(payload), zlib.crc32(payload)) + payload)
+            self.__fh.flush()
+            if self.fsync:
+                os.fsync(self.__fh.fileno())
+            self.__segments[self.__active][0] += ENTRY.size + len(payload)
+            self.__segments[self.__active][1] += 1
+            self.__pending[entry_id] = (self.__active, offset + ENTRY.size, len(payload))
+            self.written += 1
+            self.__evict()
+            return entry_id
+
+    def ack(self, entry_id: int) -> None:
+        """Mark the entry as delivered; unknown (e.g. evicted) ids are ignored."""
+        with self.__lock:
+            entry = self.__pending.pop(entry_id, None)
+            if entry is None:
+                return
+            segment = entry[0]
+            with open(self.__path(segment, ".ack"), "ab") as fh:
+                fh.write(ACK.pack(entry_id))
+            self.acked += 1
+            self.__segments[segment][1] -= 1
+            if not self.__segments[segment][1] and not (self.__fh and segment == self.__active):
+                self.__remove(segment)
+
+    def pending(self, limit: int = None) -> list:
+        """Up to `limit` unacknowledged (id, payload) pairs, oldest first."""
+        with self.__lock:
+            entries = list(self.__pending.items())[:limit]
+        result = []
+        for entry_id, (segment, offset, length) in entries:
+            try:
+                with open(self.__path(segment, ".seg"), "rb") as fh:
+                    fh.seek(offset)
+                    result.append((entry_id, fh.read(length)))
+            except FileNotFoundError:
+                # evicted meanwhile
+                pass
+        return result
+
+    def close(self) -> None:
+        with self.__lock:
+            if self.__fh:
+                self.__fh.close()
+                self.__fh = None
+
+    def __len__(self) -> int:
+        return len(self.__pending)
+
+    def get_stats(self) -> dict:
+        with self.__lock:
+            return {"pending": len(self.__pending), "segments": len(self.__segments),
+                    "bytes": sum(size for size, _ in self.__segments.values()),
+                    "written": self.written, "acked": self.acked, "evicted": self.evicted}
+
+    @property
+    def __active(self) -> int:
+        return next(reversed(self.__segments)) if self.__segments else None
+
+    def __path(self, segment: int, suffix: str) -> str:
+        return os.path.join(self.directory, f"{segment:020d}{suffix}")
+
+    def __roll(self) -> None:
+        if self.__fh:
+            self.__fh.close()
+            previous = self.__active
+            if not self.__segments[previous][1]:
+                self.__remove(previous)
+        self.__segments[self.__next_id] = [0, 0]
+        self.__fh = open(self.__path(self.__next_id, ".seg"), "ab")
+
+    def __remove(self, segment: int) -> None:
+        size, unacked = self.__segments.pop(segment)
+        if unacked:
+            self.evicted += unacked
+            for entry_id in [entry_id for entry_id, entry in self.__pending.items() if entry[0] == segment]:
+                del self.__pending[entry_id]
+        for suffix in (".seg", ".ack"):
+            try:
+                os.remove(self.__path(segment, suffix))
+            except FileNotFoundError:
+                pass
+
+    def __evict(self) -> None:
+        # never the segment being written
+        while len(self.__segments) > 1 and sum(size for size, _ in self.__segments.values()) > self.max_bytes:
+            self.__remove(next(iter(self.__segments)))
+
+    def __load(self) -> None:
+        names = sorted(entry for entry in os.listdir(self.directory) if re.match(r"\d{20}\.seg$", entry))
+        for name in names:
+            segment = int(name[:20])
+            acked = set()
+            if os.path.exists(self.__path(segment, ".ack")):
+                with open(self.__path(segment, ".ack"), "rb") as fh:
+                    data = fh.read()
+                acked = {entry_id for entry_id, in ACK.iter_unpack(data[:len(data) - len(data) % ACK.size])}
+
+            with open(self.__path(segment, ".seg"), "rb") as fh:
+                data = fh.read()
+            offset = unacked = 0
+            while offset + ENTRY.size <= len(data):
+                entry_id, length, crc = ENTRY.unpack_from(data, offset)
+                payload = data[offset + ENTRY.size:offset + ENTRY.size + length]
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    # torn write at a crash
+                    break
+                if entry_id not in acked:
+                    self.__pending[entry_id] = (segment, offset + ENTRY.size, length)
+                    unacked += 1
+                self.__next_id = max(self.__next_id, entry_id + 1)
+                offset += ENTRY.size + length
+            if offset < len(data):
+                with open(self.__path(segment, ".seg"), "r+b") as fh:
+                    fh.truncate(offset)
+            self.__segments[segment] = [offset, unacked]
+
+        # delivered segments left from the last run; new entries go to a new segment
+        for segment in [segment for segment, (_, unacked) in self.__segments.items() if not unacked]:
+            self.__remove(segment)
@@ -0,0 +1,219 @@
+"""
+Streaming percentiles with bounded memory.
+
+TDigest is a merging t-digest: samples are collected in a small buffer and
+folded into a sorted list of weighted centroids. Centroids are kept small
+near the tails (arcsine scale function), so medians and e.g. 95th percentiles
+are accurate to well under a percent of rank with about `compression`
+centroids, whatever the number of samples. Digests merge, so state saved
+before a restart is simply continued.
+
+QuantileTracker keeps one digest per selected channel of a sensor for the
+current period (e.g. hour or day, aligned to epoch multiples), emits a summary
+record when a sample of the next period arrives, and saves its state as JSON.
+"""
+
+import os
+import json
+import math
+import threading
+from common.records import Record
+
+# Buffered samples per unit of compression before they are merged
+BUFFER_FACTOR = 5
+
+
+class TDigest:
+
+    def __init__(self, compression: float = 100.0):
+        self.compression = compression
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.means = []
+        self.weights = []
+        self.__buffer = []
+
+    def add(self, x: float, weight: float = 1) -> None:
+        self.__buffer.append((x, weight))
+        self.count += weight
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+        if len(self.__buffer) >= BUFFER_FACTOR * self.compression:
+            self.compress()
+
+    def merge(self, other: "TDigest") -> None:
+        other.compress()
+        for mean, weight in zip(other.means, other.weights):
+            self.__buffer.append((mean, weight))
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.compress()
+
+    def compress(self) -> None:
+        if not self.__buffer:
+            return
+        points = sorted(list(zip(self.means, self.weights)) + self.__buffer)
+        self.__buffer = []
+
+        total = self.count
+        means, weights = [], []
+        mean, weight = points[0]
+        before = 0.0
+        limit = self.__q_limit(0.0)
+        for x, w in points[1:]:
+            if (before + weight + w) / total <= limit:
+                weight += w
+                mean += (x - mean) * w / weight
+            else:
+                means.append(mean)
+                weights.append(weight)
+                before += weight
+                limit = self.__q_limit(before / total)
+                mean, weight = x, w
+        means.append(mean)
+        weights.append(weight)
+        self.means, self.weights = means, weights
+
+    def quantile(self, q: float) -> float:
+        """Estimated value at rank q (0..1), None if empty."""
+        self.compress()
+        if not self.count:
+            return None
+        if len(self.means) == 1:
+            return self.means[0]
+
+        target = q * self.count
+        # centroid i is centred at rank `center`; interpolate between neighbouring centres
+        center = self.weights[0] / 2
+        if target <= center:
+            return self.min + (self.means[0] - self.min) * target / center if center else self.min
+        for i in range(1, len(self.means)):
+            next_center = center + (self.weights[i - 1] + self.weights[i]) / 2
+            if target <= next_center:
+                fraction = (target - center) / (next_center - center)
+                return self.means[i - 1] + (self.means[i] - self.means[i - 1]) * fraction
+            center = next_center
+        tail = self.count - center
+        return self.means[-1] + (self.max - self.means[-1]) * (target - center) / tail if tail else self.max
+
+    def to_dict(self) -> dict:
+        self.compress()
+        return {"compression": self.compression, "count": self.count,
+                "min": self.min if self.count else None, "max": self.max if self.count else None,
+                "means": self.means, "weights": self.weights}
+
+    @classmethod
+    def from_dict(cls, state: dict) -> "TDigest":
+        digest = cls(state["compression"])
+        digest.count = state["count"]
+        if digest.count:
+            digest.min, digest.max = state["min"], state["max"]
+        digest.means, digest.weights = list(state["means"]), list(state["weights"])
+        return digest
+
+    def __q_limit(self, q: float) -> float:
+        # highest rank the current centroid may reach: one unit of k(q) = compression/(2 pi) * asin(2q - 1)
+        k = self.compression / (2 * math.pi) * math.asin(2 * q - 1) + 1
+        if k >= self.compression / 4:
+            return 1.0
+        return (math.sin(2 * math.pi * k / self.compression) + 1) / 2
+
+
+_quantile_records = {}
+
+
+def quantile_record(record: type, fields: tuple, quantiles: tuple) -> type:
+    """Record type of the quantile summaries of `fields` of `record` samples."""
+    key = (record, tuple(fields), tuple(quantiles))
+    if key not in _quantile_records:
+        names = [(field, f"{field}_p{q * 100:g}") for field in fields for q in quantiles]
+        units = {"count": "1"}
+        units.update({name: record.UNITS[field] for field, name in names})
+        _quantile_records[key] = type(f"{record.__name__}Quantiles", (Record,), {
+            "__slots__": (),
+            "SENSOR": record.SENSOR,
+            "FIELDS": ("count",) + tuple(name for _, name in names),
+            "UNITS": units
+        })
+    return _quantile_records[key]
+
+
+class QuantileTracker:
+    """Per-period quantiles of selected channels of one sensor; `period` in s.
+
+    With `path`, the digests of the current period are loaded from there on
+    start and written back by save().
+    """
+
+    def __init__(self, record: type, fields: tuple, period: float, quantiles: tuple = (0.5, 0.95),
+                 compression: float = 100.0, path: str = None, callback=None):
+        self.fields = tuple(fields)
+        self.period = period
+        self.quantiles = tuple(quantiles)
+        self.compression = compression
+        self.path = os.path.expanduser(path) if path else None
+        self.callback = callback
+        self.record = quantile_record(record, self.fields, self.quantiles)
+        self.__index = [record.INDEX[field] for field in self.fields]
+        self.__period_ns = int(period * 1e9)
+        self.__start = None
+        self.__digests = None
+        self.__lock = threading.Lock()
+        if self.path and os.path.exists(self.path):
+            self.__load()
+
+    def add(self, sample) -> list:
+        """Add one record; returns the summary of the period it completed, if any (also passed to `callback`)."""
+        done = []
+        start = sample.time_ns - sample.time_ns % self.__period_ns
+        with self.__lock:
+            if self.__start is not None and start < self.__start:
+                # late sample of a period already emitted
+                return done
+            if self.__start != start:
+                if self.__start is not None:
+                    done.append(self.__summary())
+                self.__start = start
+                self.__digests = [TDigest(self.compression) for _ in self.fields]
+
+            for digest, i in zip(self.__digests, self.__index):
+                digest.add(sample.values[i])
+
+        if self.callback:
+            for result in done:
+                self.callback(result)
+        return done
+
+    def summary(self):
+        """Quantiles of the current, incomplete period, or None before the first sample."""
+        with self.__lock:
+            return self.__summary()
+
+    def save(self) -> None:
+        """Write the state of the current period to `path` (atomically)."""
+        with self.__lock:
+            if not self.path or self.__digests is None:
+                return
+            state = {"start": self.__start, "period": self.period, "fields": list(self.fields),
+                     "digests": [digest.to_dict() for digest in self.__digests]}
+        with open(self.path + ".tmp", "wt") as fh:
+            json.dump(state, fh)
+        os.replace(self.path + ".tmp", self.path)
+
+    def __load(self) -> None:
+        with open(self.path, "rt") as fh:
+            state = json.load(fh)
+        if state["period"] == self.period and tuple(state["fields"]) == self.fields:
+            self.__start = state["start"]
+            self.__digests = [TDigest.from_dict(digest) for digest in state["digests"]]
+
+    def __summary(self):
+        if self.__digests is None:
+            return None
+        count = self.__digests[0].count
+        values = [count] + [digest.quantile(q) for digest in self.__digests for q in self.quantiles]
+        return self.record(self.__start, tuple(values))
@@ -0,0 +1,76 @@
+"""
+Fixed-schema measurement records.
+
+A record holds two integer timestamps taken when the I2C read completed (epoch
+ns for alignment across sensors and hosts, monotonic ns for intervals) and the
+decoded tuple of channel values, nothing else. Timestamps are only formatted
+by the sinks, as UTC ISO 8601 with millisecond resolution. Channel names and
+units live once on the record type of each sensor (FIELDS, UNITS), so a buffer
+of thousands of samples costs a small object and a tuple per sample instead of
+nested dicts with repeated unit strings.
+"""
+
+import json
+import time
+
+
+def format_time_ns(time_ns: int) -> str:
+    seconds, ns = divmod(time_ns, 1_000_000_000)
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(seconds)) + f".{ns // 1_000_000:03d}Z"
+
+
+class Record:
+
+    __slots__ = ("time_ns", "monotonic_ns", "values")
+
+    SENSOR = None
+    FIELDS = ()
+    UNITS = {}
+    INDEX = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.INDEX = {field: i for i, field in enumerate(cls.FIELDS)}
+
+    def __init__(self, time_ns: int, values: tuple, monotonic_ns: int = None):
+        self.time_ns = time_ns
+        self.monotonic_ns = monotonic_ns
+        self.values = values
+
+    def __getitem__(self, field: str):
+        return self.values[self.INDEX[field]]
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.time_ns!r}, {self.values!r}, {self.monotonic_ns!r})"
+
+    def isoformat(self) -> str:
+        return format_time_ns(self.time_ns)
+
+    def rounded(self, ndigits: int = None) -> tuple:
+        if ndigits is None:
+            return self.values
+        return tuple(round(value, ndigits) for value in self.values)
+
+    def items(self, ndigits: int = None):
+        """(field, value) pairs of the channels, without the timestamp."""
+        return zip(self.FIELDS, self.rounded(ndigits))
+
+    def to_dict(self, ndigits: int = None) -> dict:
+        result = {"timestamp": self.isoformat()}
+        result.update(self.items(ndigits))
+        return result
+
+    def to_json(self, ndigits: int = None, **kwargs) -> str:
+        return json.dumps(self.to_dict(ndigits), **kwargs)
+
+    def to_csv(self, ndigits: int = None) -> str:
+        """Comma separated row (without line break) matching csv_header()."""
+        return ",".join(map(str, (self.isoformat(), *self.rounded(ndigits))))
+
+    @classmethod
+    def csv_header(cls) -> str:
+        return ",".join(("timestamp", *cls.FIELDS))
+
+    @classmethod
+    def schema(cls) -> dict:
+        return {"sensor": cls.SENSOR, "fields": list(cls.FIELDS), "units": dict(cls.UNITS)}
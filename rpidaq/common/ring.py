@@ -0,0 +1,65 @@
+"""
+Fixed-capacity sample buffer between an acquisition worker and its consumers.
+
+The slots are allocated once. When the buffer is full, the oldest sample is
+overwritten and counted in `overflows` instead of blocking the producer.
+Consumers either drain() everything written since their last drain, or block
+in wait_for_next() until the producer has put a new sample.
+"""
+
+import threading
+
+
+class RingBuffer:
+
+    def __init__(self, capacity: int):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self.overflows = 0
+        self.__slots = [None] * capacity
+        # running counts of samples written and consumed; slot = count % capacity
+        self.__head = 0
+        self.__tail = 0
+        self.__cond = threading.Condition()
+
+    def __len__(self) -> int:
+        with self.__cond:
+            return self.__head - self.__tail
+
+    def put(self, item) -> None:
+        with self.__cond:
+            self.__slots[self.__head % self.capacity] = item
+            self.__head += 1
+            if self.__head - self.__tail > self.capacity:
+                self.__tail += 1
+                self.overflows += 1
+            self.__cond.notify_all()
+
+    def latest(self):
+        """Most recent sample, drained or not, or None if nothing was put yet."""
+        with self.__cond:
+            return self.__slots[(self.__head - 1) % self.capacity] if self.__head else None
+
+    def drain(self) -> list:
+        """All samples put since the last drain, oldest first."""
+        with self.__cond:
+            items = [self.__slots[i % self.capacity] for i in range(self.__tail, self.__head)]
+            self.__tail = self.__head
+            return items
+
+    def wait_for_next(self, timeout: float = None):
+        """Block until a sample is put after this call and return it; None on timeout (in s)."""
+        with self.__cond:
+            seq = self.__head
+            if not self.__cond.wait_for(lambda: self.__head > seq, timeout):
+                return None
+            if self.__head - seq > self.capacity:
+                # lapped while waking up, the sample is gone
+                return self.__slots[(self.__head - 1) % self.capacity]
+            return self.__slots[seq % self.capacity]
+
+    def get_stats(self) -> dict:
+        with self.__cond:
+            return {"capacity": self.capacity, "pending": self.__head - self.__tail,
+                    "written": self.__head, "overflows": self.overflows}
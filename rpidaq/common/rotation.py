@@ -0,0 +1,123 @@
+"""
+Compression of sealed daily data files.
+
+When a daily CSVWriter switches to the next UTC day it hands the closed file to
+Archiver.submit(), which only queues the path. A background thread running at
+the lowest CPU priority gzips it to <file>.gz, writes a sidecar
+<name>-YYYYMMDD.meta.json with row count, first and last timestamp and
+sizes, and removes the original once the compressed copy is on disk. The live
+writer never waits for compression.
+"""
+
+import os
+import re
+import json
+import gzip
+import queue
+import threading
+
+CHUNK_SIZE = 1 << 20
+
+
+class Archiver:
+
+    def __init__(self, nice: int = 19, compresslevel: int = 6, logger=None):
+        self.nice = nice
+        self.compresslevel = compresslevel
+        self.logger = logger
+        self.archived = 0
+        self.errors = 0
+        self.__queue = queue.Queue()
+        self.__thread = threading.Thread(target=self.__run, name="archiver", daemon=True)
+        self.__thread.start()
+
+    def submit(self, path: str) -> None:
+        self.__queue.put(path)
+
+    def sweep(self, directory: str, name: str, before: str) -> int:
+        """Queue the uncompressed daily files <name>-YYYYMMDD.json in `directory` of days before `before` (YYYYMMDD).
+
+        Picks up files left behind when the program was not running at midnight.
+        """
+        directory = os.path.expanduser(directory)
+        pattern = re.compile(re.escape(name) + r"-(\d{8})\.json$")
+        count = 0
+        for entry in sorted(os.listdir(directory)):
+            match = pattern.match(entry)
+            if match and match.group(1) < before:
+                self.submit(os.path.join(directory, entry))
+                count += 1
+        return count
+
+    def close(self, wait: bool = True) -> None:
+        """Finish the queued files (with `wait`) and stop the worker."""
+        self.__queue.put(None)
+        if wait:
+            self.__thread.join()
+
+    def get_stats(self) -> dict:
+        return {"pending": self.__queue.qsize(), "archived": self.archived, "errors": self.errors}
+
+    def __run(self) -> None:
+        try:
+            # Linux threads have their own nice value
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), self.nice)
+        except (AttributeError, OSError):
+            pass
+
+        while True:
+            path = self.__queue.get()
+            if path is None:
+                return
+            try:
+                self.archive(path)
+                self.archived += 1
+            except Exception as err:
+                self.errors += 1
+                if self.logger:
+                    self.logger.warning(f"archiver: {path}: {type(err).__name__}: {err}")
+                else:
+                    print(f"archiver: {path}: {type(err).__name__}: {err}")
+
+    def archive(self, path: str) -> dict:
+        """Compress `path`, write its sidecar and remove it; returns the sidecar content."""
+        rows = 0
+        first = last = None
+        tail = b""
+        with open(path, "rb") as src, open(path + ".gz.tmp", "wb") as raw:
+            with gzip.GzipFile(filename=os.path.basename(path), mode="wb", fileobj=raw,
+                               compresslevel=self.compresslevel) as dst:
+                while True:
+                    chunk = src.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    lines = (tail + chunk).split(b"\n")
+                    tail = lines.pop()
+                    for line in lines:
+                        # the metadata header is a JSON object, data rows start with their timestamp
+                        if line and not line.startswith(b"{"):
+                            rows += 1
+                            if first is None:
+                                first = line
+                            last = line
+                if tail and not tail.startswith(b"{"):
+                    rows += 1
+                    first = first or tail
+                    last = tail
+            raw.flush()
+            os.fsync(raw.fileno())
+
+        sidecar = {
+            "file": os.path.basename(path) + ".gz",
+            "rows": rows,
+            "first": first.split(b",", 1)[0].decode() if first else None,
+            "last": last.split(b",", 1)[0].decode() if last else None,
+            "bytes": os.path.getsize(path),
+            "compressed_bytes": os.path.getsize(path + ".gz.tmp")
+        }
+        os.replace(path + ".gz.tmp", path + ".gz")
+        with open(os.path.splitext(path)[0] + ".meta.json", "wt") as fh:
+            json.dump(sidecar, fh)
+        os.remove(path)
+        return sidecar
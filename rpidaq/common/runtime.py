@@ -0,0 +1,133 @@
+"""
+asyncio runtime joining acquisition, sinks and publishers.
+
+Sensors keep acquiring on their bus worker (common.acquisition) and push each
+sample into the event loop. Every sink gets its own bounded asyncio queue per
+sensor and runs as a task, so a slow file write or MQTT round trip only delays
+that sink: when its queue is full, new samples are dropped for that sink and
+counted. Blocking handlers (file I/O, I2C metadata queries) run on a small
+shared executor; coroutine handlers run on the loop. Futures of other
+libraries, e.g. the concurrent.futures returned by awscrt, are awaited with
+asyncio.wrap_future.
+"""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from common.clock import Clock
+from common.scheduler import Task
+
+
+class Runtime:
+
+    def __init__(self, clock: Clock = None, queue_size: int = 100, workers: int = 2):
+        self.clock = clock if clock else Clock()
+        self.queue_size = queue_size
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="runtime")
+        self.sensors = {}
+        self.sinks = {}
+        self.periodic = {}
+        self.__routes = {}
+        self.__loop = None
+        self.__stop = None
+
+    def add_sensor(self, name: str, sensor) -> None:
+        """`sensor` is anything with subscribe()/unsubscribe(), e.g. SPS30 or SCD30."""
+        self.sensors[name] = sensor
+
+    def add_sink(self, name: str, sensors: list, handler) -> None:
+        """Call `handler(record)` for every sample of the named sensors, in arrival order."""
+        self.sinks[name] = {"sensors": sensors, "handler": handler,
+                            "received": 0, "dropped": 0, "errors": 0}
+
+    def add_periodic(self, name: str, period: float, handler, offset: float = 0.0) -> Task:
+        """Call `handler()` every `period` s, aligned to wall-clock boundaries (see common.scheduler.Task)."""
+        self.periodic[name] = Task(name, period, handler, offset)
+        return self.periodic[name]
+
+    async def call(self, func, *args):
+        """Run a blocking function on the runtime's executor."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(func, *args))
+
+    async def run(self) -> None:
+        """Run all sinks and periodic tasks until stop() is called."""
+        self.__loop = asyncio.get_running_loop()
+        self.__stop = asyncio.Event()
+
+        tasks = []
+        self.__routes = {name: [] for name in self.sensors}
+        for name, sink in self.sinks.items():
+            queue = asyncio.Queue(maxsize=self.queue_size)
+            for sensor in sink["sensors"]:
+                self.__routes[sensor].append((sink, queue))
+            tasks.append(asyncio.create_task(self.__consume(name, sink, queue), name=name))
+        for name, task in self.periodic.items():
+            tasks.append(asyncio.create_task(self.__repeat(task), name=name))
+
+        callbacks = {name: functools.partial(self.__arrived, name) for name in self.sensors}
+        for name, callback in callbacks.items():
+            self.sensors[name].subscribe(callback)
+
+        try:
+            await self.__stop.wait()
+        finally:
+            for name, callback in callbacks.items():
+                self.sensors[name].unsubscribe(callback)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stop(self) -> None:
+        """Stop run(); may be called from any thread."""
+        if self.__loop and self.__stop:
+            self.__loop.call_soon_threadsafe(self.__stop.set)
+
+    def get_stats(self) -> dict:
+        stats = {name: {key: sink[key] for key in ("received", "dropped", "errors")}
+                 for name, sink in self.sinks.items()}
+        stats.update({name: task.get_stats() for name, task in self.periodic.items()})
+        return stats
+
+    def __arrived(self, name: str, record) -> None:
+        # called on the sensor's dispatch thread
+        try:
+            self.__loop.call_soon_threadsafe(self.__route, name, record)
+        except RuntimeError:
+            # loop already closed, run() has ended
+            pass
+
+    def __route(self, name: str, record) -> None:
+        for sink, queue in self.__routes[name]:
+            try:
+                queue.put_nowait(record)
+            except asyncio.QueueFull:
+                sink["dropped"] += 1
+
+    async def __handle(self, name: str, handler, *args) -> bool:
+        try:
+            if asyncio.iscoroutinefunction(handler):
+                await handler(*args)
+            else:
+                await self.call(handler, *args)
+            return True
+        except Exception as err:
+            print(f"{name}: {type(err).__name__}: {err}")
+            return False
+
+    async def __consume(self, name: str, sink: dict, queue: asyncio.Queue) -> None:
+        while True:
+            record = await queue.get()
+            sink["received"] += 1
+            if not await self.__handle(name, sink["handler"], record):
+                sink["errors"] += 1
+
+    async def __repeat(self, task: Task) -> None:
+        while True:
+            delay = task.delay(self.clock.time())
+            if delay > 0:
+                await asyncio.sleep(delay / self.clock.speedup)
+                continue
+            task.begin(self.clock.time())
+            if not await self.__handle(task.name, task.callback):
+                task.errors += 1
+            task.end(self.clock.time())
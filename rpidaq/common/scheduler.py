@@ -0,0 +1,201 @@
+"""
+Scheduling of data-ready polls and of periodic application tasks.
+
+A Sensirion sensor raises its data-ready flag on a fixed internal cadence.
+ReadyScheduler learns that cadence and its phase from the polls themselves and
+returns the delay until the next poll, so that the driver wakes just after the
+predicted ready time instead of sleeping a full sampling period after a miss.
+
+Task keeps the deadlines of a periodic application task, run by
+common.runtime.Runtime, aligned to wall-clock boundaries, e.g. every full
+minute, so the cadence does not drift by the execution time of the task. A task
+still running at its next deadline counts as an overrun; deadlines that have
+passed are skipped, not run late in a burst. Jitter is the delay between
+deadline and actual start.
+"""
+
+import math
+import threading
+
+# Longest single sleep before a periodic task, in s, so that wall clock changes are noticed
+MAX_SLEEP = 5.0
+
+
+class ReadyScheduler:
+    """Predicts the next data-ready edge of one device.
+
+    period       wanted time between reads, in s (the driver's sampling period)
+    interval     nominal data-ready cadence of the device, in s (refined while running)
+    margin       how long after the predicted edge to poll, in s
+    backoff      first retry delay after a miss, in s (doubles per consecutive miss)
+    probe_every  every n-th poll is aimed just before the predicted edge, so that
+                 drift between device and host clock is caught by a miss
+    alpha        weight of a new cadence observation
+    tolerance    the learned cadence stays within this fraction of the nominal one
+                 (the sensor's oscillator accuracy, with room for host clock error)
+
+    A probe that finds the data already ready means the prediction runs late:
+    the predicted edge is moved back by the probe's lead, and the next polls
+    probe with twice the lead until one misses and the edge is measured again.
+
+    With a period longer than the cadence, reads skip edges and an older sample
+    is always waiting, so a poll cannot tell where the edge is. Reads are then
+    aimed just after the predicted edge nearest to a period after the last read
+    (predicted from the last measured edge, without probing), but never less
+    than a period apart.
+    """
+
+    def __init__(self, period: float, interval: float = None, margin: float = 0.01, backoff: float = 0.02,
+                 probe_every: int = 16, alpha: float = 0.2, tolerance: float = 0.05):
+        self.period = period
+        self.interval = interval if interval else period
+        self.margin = margin
+        self.backoff = backoff
+        self.probe_every = probe_every
+        self.alpha = alpha
+        self.nominal = self.interval
+        self.tolerance = tolerance
+
+        self.polls = 0
+        self.hits = 0
+        self.errors = 0
+        self.__lock = threading.Lock()
+        self.__misses = 0
+        self.__last_miss = None
+        self.__edge = None
+        self.__next = None
+        self.__cycles = 0
+        self.__since_probe = 0
+        self.__probing = False
+        self.__lead = margin
+
+    def hit(self, now: float) -> float:
+        """Data was ready and has been read at monotonic time `now`; return the delay to the next poll."""
+        with self.__lock:
+            self.polls += 1
+            self.hits += 1
+
+            if self.__misses:
+                # we polled across the edge, so it lies between the last miss and now
+                edge = (self.__last_miss + now) / 2
+                if self.__edge is not None and self.__cycles:
+                    # the predicted edge that was just measured is __cycles cadences after the last measured one
+                    observed = (edge - self.__edge) / self.__cycles
+                    interval = self.interval + self.alpha * (observed - self.interval)
+                    low, high = self.nominal * (1 - self.tolerance), self.nominal * (1 + self.tolerance)
+                    self.interval = min(max(interval, low), high)
+                self.__edge = edge
+                self.__next = edge
+                self.__cycles = 0
+                self.__misses = 0
+                self.__lead = self.margin
+            elif self.__probing:
+                # ready before the predicted edge: the prediction runs late by at least the lead
+                self.__next -= self.__lead
+                self.__lead = min(2 * self.__lead, self.interval / 2)
+            elif self.__next is None:
+                self.__next = now
+
+            skipping = self.period > self.nominal
+            if skipping:
+                # predicted edge nearest to a period after this read
+                target = now + self.period - self.interval / 2
+            else:
+                # first predicted edge at least one period (and one cadence) after this read
+                target = now + max(self.period, self.interval) - self.interval / 2
+            while self.__next < target:
+                self.__next += self.interval
+                self.__cycles += 1
+
+            self.__since_probe += 1
+            self.__probing = not skipping and (self.__lead > self.margin or self.__since_probe >= self.probe_every)
+            if self.__probing:
+                self.__since_probe = 0
+                wake = self.__next - self.__lead
+            else:
+                wake = self.__next + self.margin
+            if skipping:
+                wake = max(wake, now + self.period)
+
+            return max(0.0, wake - now)
+
+    def miss(self, now: float) -> float:
+        """Data was not ready at monotonic time `now`; return the (short) delay to the retry."""
+        with self.__lock:
+            self.polls += 1
+            self.__misses += 1
+            self.__last_miss = now
+            self.__probing = False
+            return min(self.backoff * 2 ** (self.__misses - 1), self.interval / 4)
+
+    def retry(self) -> float:
+        """The data-ready reply was corrupted: neither hit nor miss; return the delay to the retry."""
+        with self.__lock:
+            self.polls += 1
+            self.errors += 1
+            return self.backoff
+
+    def get_stats(self) -> dict:
+        """Polls, reads and the polls-per-read ratio (1.0 means no wasted bus time)."""
+        with self.__lock:
+            return {
+                "polls": self.polls,
+                "hits": self.hits,
+                "misses": self.polls - self.hits - self.errors,
+                "errors": self.errors,
+                "poll_ratio": self.polls / self.hits if self.hits else None,
+                "interval": self.interval
+            }
+
+
+class Task:
+
+    def __init__(self, name: str, period: float, callback, offset: float = 0.0):
+        self.name = name
+        self.period = period
+        self.callback = callback
+        self.offset = offset
+        self.deadline = None
+        self.runs = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.errors = 0
+        self.jitter_sum = 0.0
+        self.jitter_max = 0.0
+
+    def next_deadline(self, now: float) -> float:
+        """First boundary (multiple of period, plus offset, in epoch s) after `now`."""
+        return (math.floor((now - self.offset) / self.period) + 1) * self.period + self.offset
+
+    def delay(self, now: float) -> float:
+        """How long to sleep before looking again, in s (at most MAX_SLEEP); 0 when the task is due."""
+        if self.deadline is None or self.deadline - now > self.period:
+            # first run, or the wall clock was set back: realign instead of waiting for the old deadline
+            self.deadline = self.next_deadline(now)
+        return min(max(0.0, self.deadline - now), MAX_SLEEP)
+
+    def begin(self, now: float) -> None:
+        """The task starts at `now`, at or after its deadline."""
+        jitter = now - self.deadline
+        self.runs += 1
+        self.jitter_sum += jitter
+        self.jitter_max = max(self.jitter_max, jitter)
+
+    def end(self, now: float) -> None:
+        """The task finished at `now`: move on to the next deadline, skipping those already passed."""
+        self.deadline += self.period
+        if now >= self.deadline:
+            self.overruns += 1
+            next_deadline = self.next_deadline(now)
+            self.skipped += round((next_deadline - self.deadline) / self.period)
+            self.deadline = next_deadline
+
+    def get_stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "overruns": self.overruns,
+            "skipped": self.skipped,
+            "errors": self.errors,
+            "jitter_mean": self.jitter_sum / self.runs if self.runs else None,
+            "jitter_max": self.jitter_max
+        }
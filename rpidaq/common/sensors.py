@@ -0,0 +1,72 @@
+"""
+Opening the configured sensors and starting acquisition, shared by app.py and aws_publish.py.
+
+With `acquisition: process: true` the drivers run in a child process
+(common.shm.AcquisitionProcess) and the returned sensors are the readers of
+its shared-memory rings, which offer the same consumer interface
+(get_measurement, drain, subscribe). The rings are named <name>-<sensor>
+(`acquisition: name`, default "rpidaq"), so that other processes, e.g. a
+separate logger, can attach to them with SharedRing(name, record, fmt, track=False).
+"""
+
+import os
+from common.clock import Clock, VirtualClock
+from common.emulator import emulated_bus, SPS30_ADDRESS, SCD30_ADDRESS
+from common.shm import AcquisitionProcess
+from sps30.sps30 import SPS30
+from scd30.scd30 import SCD30
+
+
+def open_bus(cfg: dict) -> tuple:
+    """Clock and bus to use: emulated sensors if enabled, else real time and /dev/i2c-1 (bus None)."""
+    if cfg.get("emulator", {}).get("enabled"):
+        clock = VirtualClock(speedup=cfg["emulator"].get("speedup", 1))
+        return clock, emulated_bus(clock)
+    return Clock(), None
+
+
+def open_sensors(cfg: dict, clock: Clock = None, bus=None) -> dict:
+    """SPS30 and SCD30 drivers as configured, by name. Also called in the acquisition process."""
+    if clock is None:
+        clock, bus = open_bus(cfg)
+
+    sensors = {}
+    if cfg["sensors"]["sps30"]:
+        sensors["sps30"] = SPS30(i2c=bus.device(SPS30_ADDRESS) if bus else None, clock=clock,
+                                 data_format=cfg.get("sps30", {}).get("data_format", "IEEE754_float"),
+                                 buffer_size=cfg.get("sps30", {}).get("buffer_size", 300),
+                                 capture=os.path.expanduser(cfg['data']) + "/sps30.raw" if cfg.get("capture") else None)
+    if cfg["sensors"]["scd30"]:
+        sensors["scd30"] = SCD30(sampling_period=cfg.get("scd30", {}).get("sampling_period", 10),
+                                 pressure=cfg.get("scd30", {}).get("pressure", 960),
+                                 i2c=bus.device(SCD30_ADDRESS) if bus else None, clock=clock,
+                                 buffer_size=cfg.get("scd30", {}).get("buffer_size", 300),
+                                 capture=os.path.expanduser(cfg['data']) + "/scd30.raw" if cfg.get("capture") else None)
+    return sensors
+
+
+def start_acquisition(cfg: dict, sensors: dict) -> tuple:
+    """Start measuring; returns (AcquisitionProcess or None, sensors to consume from)."""
+    acquisition_cfg = cfg.get("acquisition") or {}
+    if not acquisition_cfg.get("process"):
+        for sensor in sensors.values():
+            sensor.start_measurement()
+        return None, sensors
+
+    # the child process opens its own drivers; samples come through shared memory
+    for sensor in sensors.values():
+        sensor.close()
+    acquisition = AcquisitionProcess(open_sensors, (cfg,),
+                                     {name: (sensor.record, sensor.decoder.layout.format) for name, sensor in sensors.items()},
+                                     capacity=acquisition_cfg.get("capacity", 3600),
+                                     prefix=acquisition_cfg.get("name", "rpidaq"))
+    acquisition.start()
+    return acquisition, acquisition.rings
+
+
+def stop_acquisition(acquisition: AcquisitionProcess, sensors: dict) -> None:
+    if acquisition:
+        acquisition.stop()
+    else:
+        for sensor in sensors.values():
+            sensor.stop_measurement()
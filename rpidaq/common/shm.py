@@ -0,0 +1,196 @@
+"""
+Acquisition in a dedicated process, handing samples over in shared memory.
+
+JSON formatting, file I/O and MQTT callbacks share the interpreter (and GIL)
+with the I2C worker when everything runs in one process, and their pauses show
+up as timestamp jitter. AcquisitionProcess runs the drivers in a child process
+instead; every sample is written as a fixed-size binary slot into a
+SharedRing in multiprocessing.shared_memory, and consumer processes decode it
+straight from the shared buffer.
+
+Ring layout (little-endian):
+    header  samples written (Q), capacity (Q)
+    slot    timestamp ns (q), monotonic ns (q), values (record struct format)
+
+There is one writer per ring. A reader copies the slots between its cursor and
+the write count and then re-reads the count: slots the writer may have
+overwritten meanwhile, or be overwriting (the slot of sample count -
+capacity), are discarded and counted in `overruns`.
+"""
+
+import struct
+import threading
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+
+COUNTS = struct.Struct("<QQ")
+WRITTEN = struct.Struct("<Q")
+
+# How often a subscribed reader looks for new samples, in s
+POLL_INTERVAL = 0.05
+
+
+class SharedRing:
+    """Ring of `record` samples with values packed as `fmt` (e.g. the driver's ">10f").
+
+    Readers offer the consumer side of the drivers (get_measurement, drain,
+    subscribe), so sinks do not care in which process acquisition runs.
+
+    With `create`, a ring of the same name left over by a crashed run is
+    replaced. A process that is not a child of the creator attaches with
+    `track=False`, so that its exit does not remove the ring (the resource
+    tracker of each process unlinks the shared memory it knows of).
+    """
+
+    def __init__(self, name: str, record: type, fmt: str, capacity: int = 3600, create: bool = False,
+                 track: bool = True):
+        self.record = record
+        self.fmt = fmt
+        self.slot = struct.Struct("<qq" + fmt.lstrip("@=<>!"))
+        if create:
+            size = COUNTS.size + capacity * self.slot.size
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            except FileExistsError:
+                stale = shared_memory.SharedMemory(name=name)
+                stale.close()
+                stale.unlink()
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            COUNTS.pack_into(self.shm.buf, 0, 0, capacity)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            if not track:
+                resource_tracker.unregister(self.shm._name, "shared_memory")
+        self.name = self.shm.name
+        self.capacity = COUNTS.unpack_from(self.shm.buf, 0)[1]
+        self.overruns = 0
+        self.__written = WRITTEN.unpack_from(self.shm.buf, 0)[0]
+        self.__cursor = self.__written
+        self.__subscribers = []
+        self.__poller = None
+        self.__stop = threading.Event()
+
+    # writer side
+
+    def put(self, record) -> None:
+        offset = COUNTS.size + self.__written % self.capacity * self.slot.size
+        self.slot.pack_into(self.shm.buf, offset, record.time_ns, record.monotonic_ns or 0, *record.values)
+        self.__written += 1
+        # publish the slot only after it is complete
+        WRITTEN.pack_into(self.shm.buf, 0, self.__written)
+
+    # reader side
+
+    def written(self) -> int:
+        return WRITTEN.unpack_from(self.shm.buf, 0)[0]
+
+    def drain(self) -> list:
+        """All samples written since the last drain (or since attaching), oldest first."""
+        buf = self.shm.buf
+        written = self.written()
+        # the writer may already be packing sample `written` into the slot of sample written - capacity
+        start = max(self.__cursor, written + 1 - self.capacity)
+        slots = [self.slot.unpack_from(buf, COUNTS.size + i % self.capacity * self.slot.size)
+                 for i in range(start, written)]
+
+        # slots lapped by the writer while copying may be torn
+        lost = max(start, self.written() + 1 - self.capacity) - start
+        self.overruns += start - self.__cursor + lost
+        self.__cursor = written
+        return [self.record(slot[0], slot[2:], slot[1]) for slot in slots[lost:]]
+
+    def get_measurement(self):
+        """Most recent sample, or None if nothing was written yet."""
+        written = self.written()
+        if not written:
+            return None
+        slot = self.slot.unpack_from(self.shm.buf, COUNTS.size + (written - 1) % self.capacity * self.slot.size)
+        return self.record(slot[0], slot[2:], slot[1])
+
+    def subscribe(self, callback) -> None:
+        """Call `callback(record)` with every new sample, from a thread polling every POLL_INTERVAL s."""
+        self.__subscribers = self.__subscribers + [callback]
+        if self.__poller is None:
+            self.__stop.clear()
+            self.__poller = threading.Thread(target=self.__poll, name=f"ring-{self.name}", daemon=True)
+            self.__poller.start()
+
+    def unsubscribe(self, callback) -> None:
+        self.__subscribers = [subscriber for subscriber in self.__subscribers if subscriber != callback]
+        if not self.__subscribers and self.__poller is not None:
+            self.__stop.set()
+            self.__poller.join()
+            self.__poller = None
+
+    def get_stats(self) -> dict:
+        return {"capacity": self.capacity, "written": self.written(), "overruns": self.overruns}
+
+    def close(self, unlink: bool = False) -> None:
+        if self.__poller is not None:
+            self.__subscribers = []
+            self.__stop.set()
+            self.__poller.join()
+            self.__poller = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+    def __poll(self) -> None:
+        while not self.__stop.wait(POLL_INTERVAL):
+            for record in self.drain():
+                for callback in self.__subscribers:
+                    try:
+                        callback(record)
+                    except Exception as err:
+                        print(f"{getattr(callback, '__name__', callback)}: {type(err).__name__}: {err}")
+
+
+def _acquire(factory, args: tuple, rings: dict, stop) -> None:
+    # child process: open the drivers here, never inherit bus handles or threads
+    sensors = factory(*args)
+    writers = {name: SharedRing(shm_name, record, fmt) for name, (shm_name, record, fmt) in rings.items()}
+    for name, sensor in sensors.items():
+        sensor.subscribe(writers[name].put)
+        sensor.start_measurement()
+    try:
+        stop.wait()
+    except KeyboardInterrupt:
+        # Ctrl-C reaches the whole process group; the parent decides when to stop
+        stop.wait()
+    finally:
+        for sensor in sensors.values():
+            sensor.stop_measurement()
+        for writer in writers.values():
+            writer.close()
+
+
+class AcquisitionProcess:
+    """Runs `factory(*args)` -> {name: driver} in a child process, with one SharedRing per driver.
+
+    `rings` maps each driver name to (record type, struct format) of its
+    samples; the readers are available in `self.rings` once started. With
+    `prefix`, ring names are <prefix>-<driver name> instead of random, so
+    other processes can attach to them.
+    """
+
+    def __init__(self, factory, args: tuple, rings: dict, capacity: int = 3600, prefix: str = None):
+        self.factory = factory
+        self.args = args
+        self.capacity = capacity
+        self.rings = {name: SharedRing(f"{prefix}-{name}" if prefix else None, record, fmt, capacity, create=True)
+                      for name, (record, fmt) in rings.items()}
+        self.__stop = multiprocessing.Event()
+        self.process = None
+
+    def start(self) -> None:
+        rings = {name: (ring.name, ring.record, ring.fmt) for name, ring in self.rings.items()}
+        self.process = multiprocessing.Process(target=_acquire, args=(self.factory, self.args, rings, self.__stop),
+                                               name="acquisition", daemon=True)
+        self.process.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self.__stop.set()
+        if self.process:
+            self.process.join(timeout)
+        for ring in self.rings.values():
+            ring.close(unlink=True)
@@ -0,0 +1,149 @@
+"""
+Fixed-width binary time series of measurement records.
+
+SegmentWriter appends each record as one little-endian int64 epoch ns
+timestamp followed by the channels as float32, to one segment file
+<name>-YYYYMMDD.bin per UTC day; <name>.schema.json next to them holds the
+record schema and the struct format. Samples of a sensor arrive in time order,
+so a segment is sorted by timestamp.
+
+SegmentReader memory-maps the segments and finds the ends of a time range by
+binary search on the timestamps, so a range query touches only the pages of
+the matching rows, however large the archive. With numpy installed the rows
+are returned as a structured array viewing the mapped file (no copy when the
+range lies within one day); without it, as records.
+"""
+
+import os
+import re
+import json
+import mmap
+import struct
+from common.clock import Clock
+from common.writer import FileWriter, NS_PER_DAY, day_string
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+def segment_format(record: type) -> str:
+    return "<q" + "f" * len(record.FIELDS)
+
+
+def segment_path(directory: str, name: str, day_ns: int) -> str:
+    return os.path.join(directory, f"{name}-{day_string(day_ns)}.bin")
+
+
+class SegmentWriter(FileWriter):
+    """Sink appending `record` samples to daily segments in `directory`; same interface as CSVWriter."""
+
+    def __init__(self, directory: str, name: str, record: type, flush_interval: float = 10.0,
+                 fsync_interval: float = 300.0, clock: Clock = None):
+        super().__init__(True, flush_interval, fsync_interval, clock=clock)
+        self.directory = os.path.expanduser(directory)
+        self.name = name
+        self.record = record
+        self.struct = struct.Struct(segment_format(record))
+
+        schema = record.schema()
+        schema["format"] = self.struct.format
+        with open(os.path.join(self.directory, f"{name}.schema.json"), "wt") as fh:
+            json.dump(schema, fh)
+
+    def write(self, record) -> None:
+        self.append(record.time_ns, self.struct.pack(record.time_ns, *record.values))
+
+    def filename(self, day_ns: int) -> str:
+        return segment_path(self.directory, self.name, day_ns)
+
+    def opened(self, fh, new: bool) -> None:
+        # drop a partial row left by a crash, so rows stay aligned
+        size = fh.tell()
+        if size % self.struct.size:
+            fh.truncate(size - size % self.struct.size)
+
+
+class SegmentReader:
+    """Range queries over the segments written by SegmentWriter for `record` samples."""
+
+    def __init__(self, directory: str, name: str, record: type):
+        self.directory = os.path.expanduser(directory)
+        self.name = name
+        self.record = record
+        self.struct = struct.Struct(segment_format(record))
+        self.dtype = None
+        if np is not None:
+            self.dtype = np.dtype([("time_ns", "<i8")] + [(field, "<f4") for field in record.FIELDS])
+        # path -> (mmap, rows); a segment still being written is mapped again when it has grown
+        self.__maps = {}
+
+    def query(self, start_ns: int, end_ns: int):
+        """Rows with start_ns <= timestamp < end_ns.
+
+        A numpy structured array (fields time_ns and the record's FIELDS) if numpy is available,
+        else a list of records.
+        """
+        parts = list(self.segments(start_ns, end_ns))
+        if self.dtype is None:
+            return [row for part in parts for row in part]
+        if not parts:
+            return np.empty(0, dtype=self.dtype)
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def segments(self, start_ns: int, end_ns: int):
+        """Rows of the range per daily segment; numpy arrays here are views of the mapped files."""
+        first = segment_path(self.directory, self.name, start_ns - start_ns % NS_PER_DAY)
+        last = segment_path(self.directory, self.name, end_ns - end_ns % NS_PER_DAY)
+        for path in self.paths():
+            if not first <= path <= last:
+                continue
+            mapped = self.__map(path)
+            if mapped:
+                buffer, rows = mapped
+                lo = self.__search(buffer, rows, start_ns)
+                hi = self.__search(buffer, rows, end_ns)
+                if lo < hi:
+                    yield self.__rows(buffer, lo, hi)
+
+    def paths(self) -> list:
+        """The segment files, oldest first."""
+        pattern = re.compile(re.escape(self.name) + r"-\d{8}\.bin$")
+        return sorted(os.path.join(self.directory, entry) for entry in os.listdir(self.directory) if pattern.match(entry))
+
+    def close(self) -> None:
+        # arrays returned by query() may still view the maps; they are released with the last reference
+        self.__maps = {}
+
+    def __map(self, path: str):
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return None
+        rows = size // self.struct.size
+        mapped = self.__maps.get(path)
+        if mapped is None or mapped[1] != rows:
+            if not rows:
+                return None
+            with open(path, "rb") as fh:
+                buffer = mmap.mmap(fh.fileno(), rows * self.struct.size, access=mmap.ACCESS_READ)
+            mapped = self.__maps[path] = (buffer, rows)
+        return mapped
+
+    def __search(self, buffer, rows: int, time_ns: int) -> int:
+        # first row with timestamp >= time_ns
+        size = self.struct.size
+        lo, hi = 0, rows
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if struct.unpack_from("<q", buffer, mid * size)[0] < time_ns:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def __rows(self, buffer, lo: int, hi: int):
+        if self.dtype is not None:
+            return np.frombuffer(buffer, dtype=self.dtype, count=hi - lo, offset=lo * self.struct.size)
+        return [self.record(row[0], row[1:])
+                for row in self.struct.iter_unpack(memoryview(buffer)[lo * self.struct.size:hi * self.struct.size])]
@@ -0,0 +1,146 @@
+"""
+Buffered file sinks for measurement records.
+
+FileWriter keeps the file open between samples and writes into a userspace
+buffer that goes to the file every `flush_interval` s. The data reaches the
+SD card (fsync) every `fsync_interval` s and on close. With `daily`, entries
+go to one file per UTC date of their timestamp, and the file is switched when
+the first entry of a new day arrives, instead of building the file name for
+every sample. The sealed file of the previous day is passed to `on_rollover`
+(e.g. Archiver.submit), which must not block. CSVWriter, and the binary
+SegmentWriter and CaptureWriter, only name their files and prepare a newly
+opened one.
+
+CSVWriter formats each row in one pass from a template built once per record
+type, and also flushes when `flush_bytes` have accumulated. With `daily`, rows
+go to <name>-YYYYMMDD.json.
+
+Sinks share a small interface: write(record), flush(), close().
+"""
+
+import os
+import time
+import threading
+from common.clock import Clock
+
+NS_PER_DAY = 86400 * 1_000_000_000
+
+
+def day_string(day_ns: int) -> str:
+    """YYYYMMDD of the UTC day starting at `day_ns`."""
+    return time.strftime("%Y%m%d", time.gmtime(day_ns // 1_000_000_000))
+
+
+class FileWriter:
+    """Append-only file with a flush/fsync time policy and optional daily rollover.
+
+    Subclasses return the path to write in filename(day_ns), with day_ns the
+    start of the UTC day if `daily`, else None, and may write a header or cut
+    off a partial entry left by a power cut in opened(fh, new).
+    """
+
+    mode = "ab"
+
+    def __init__(self, daily: bool = False, flush_interval: float = 10.0, fsync_interval: float = 300.0,
+                 buffering: int = -1, clock: Clock = None, on_rollover=None):
+        self.daily = daily
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.buffering = buffering
+        self.clock = clock if clock else Clock()
+        self.on_rollover = on_rollover
+        self.path = None
+        self.rows = 0
+        self.__fh = None
+        self.__day_end = None
+        self.__last_flush = self.__last_fsync = self.clock.monotonic()
+        self.__lock = threading.Lock()
+
+    def filename(self, day_ns: int) -> str:
+        raise NotImplementedError
+
+    def opened(self, fh, new: bool) -> None:
+        pass
+
+    def append(self, time_ns: int, *chunks) -> None:
+        """Write one entry, made of `chunks`, to the file of the day of `time_ns`."""
+        with self.__lock:
+            if self.__fh is None or self.daily and time_ns >= self.__day_end:
+                self.__open(time_ns)
+            for chunk in chunks:
+                self.__fh.write(chunk)
+            self.rows += 1
+
+            now = self.clock.monotonic()
+            if now - self.__last_flush >= self.flush_interval:
+                self.__flush(now)
+
+    def flush(self) -> None:
+        with self.__lock:
+            if self.__fh:
+                self.__flush(self.clock.monotonic())
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__close()
+
+    def __flush(self, now: float) -> None:
+        self.__fh.flush()
+        self.__last_flush = now
+        if self.fsync_interval and now - self.__last_fsync >= self.fsync_interval:
+            os.fsync(self.__fh.fileno())
+            self.__last_fsync = now
+
+    def __close(self) -> None:
+        if self.__fh:
+            self.__fh.flush()
+            os.fsync(self.__fh.fileno())
+            self.__fh.close()
+            self.__fh = None
+
+    def __open(self, time_ns: int) -> None:
+        day = None
+        if self.daily:
+            sealed = self.path if self.__fh else None
+            self.__close()
+            if sealed and self.on_rollover:
+                self.on_rollover(sealed)
+            day = time_ns - time_ns % NS_PER_DAY
+            self.__day_end = day + NS_PER_DAY
+
+        self.path = self.filename(day)
+        new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self.__fh = open(self.path, self.mode, buffering=self.buffering)
+        self.opened(self.__fh, new)
+        self.__last_flush = self.__last_fsync = self.clock.monotonic()
+
+
+class CSVWriter(FileWriter):
+
+    mode = "at"
+
+    def __init__(self, directory: str, name: str, precision: int = None, daily: bool = False, header: str = None,
+                 flush_bytes: int = 65536, flush_interval: float = 10.0, fsync_interval: float = 300.0,
+                 clock: Clock = None, on_rollover=None):
+        super().__init__(daily, flush_interval, fsync_interval, flush_bytes, clock, on_rollover)
+        self.directory = os.path.expanduser(directory)
+        self.name = name
+        self.precision = precision
+        self.header = header
+        self.flush_bytes = flush_bytes
+        self.__templates = {}
+
+    def write(self, record) -> None:
+        template = self.__templates.get(type(record))
+        if template is None:
+            template = self.__templates[type(record)] = "%s" + ",%s" * len(record.FIELDS) + "\n"
+        self.append(record.time_ns, template % (record.isoformat(), *record.rounded(self.precision)))
+
+    def filename(self, day_ns: int) -> str:
+        if day_ns is None:
+            return os.path.join(self.directory, f"{self.name}.json")
+        return os.path.join(self.directory, f"{self.name}-{day_string(day_ns)}.json")
+
+    def opened(self, fh, new: bool) -> None:
+        if new and self.header:
+            fh.write(self.header + "\n")
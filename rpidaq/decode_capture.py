@@ -0,0 +1,30 @@
+"""
+Decode a raw capture file (see common/capture.py) to CSV on stdout.
+
+    $ python decode_capture.py ~/Documents/data/sps30.raw > sps30.csv
+"""
+
+import sys
+import argparse
+from common.capture import CaptureReader
+from sps30.sps30 import SPS30Record, SPS30IntegerRecord
+from scd30.scd30 import SCD30Record
+
+RECORDS = {record.__name__: record for record in (SPS30Record, SPS30IntegerRecord, SCD30Record)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode a raw SPS30/SCD30 capture file to CSV.")
+    parser.add_argument("path", help="Capture file.")
+    parser.add_argument("--precision", type=int, default=None, help="Decimals of measured values.")
+    args = parser.parse_args()
+
+    reader = CaptureReader(args.path, RECORDS)
+    print(reader.record.csv_header())
+    for record in reader.records():
+        print(record.to_csv(args.precision))
+    print(f"{len(reader)} frames, {reader.bad_frames} with CRC errors", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -26,14 +26,17 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
-import sys
-import threading
 import logging
-from time import sleep
-from queue import Queue
-from datetime import datetime
-from common.i2c import I2C
+from common.bus import I2CBus, PRIORITY_MEASUREMENT
+from common.clock import Clock
 from common.crc import CRC
+from common.decode import FrameDecoder
+from common.records import Record
+from common.capture import CaptureWriter
+from common.ring import RingBuffer
+from common.dispatch import Dispatcher
+from common.scheduler import ReadyScheduler
+from common.acquisition import AcquisitionEngine
 
 # I2C commands
 CMD_GET_FIRMWARE_VERSION = [0xD1, 0x00]
@@ -49,6 +52,12 @@ NBYTES_GET_FIRMWARE_VERSION = 3
 NBYTES_GET_DATA_READY_FLAG = 3
 NBYTES_MEASURED_VALUES_FLOAT = 18  # IEEE754 float
 
+# Default continuous measurement interval of the SCD30, in s
+DATA_READY_INTERVAL = 2.0
+
+# The SCD30 does not support repeated start; wait between command and read, in seconds
+READ_DELAY = 0.003
+
 # Packet size including checksum byte [data1, data2, checksum]
 PACKET_SIZE = 3
 
@@ -56,57 +65,68 @@ PACKET_SIZE = 3
 SIZE_FLOAT = 6  # IEEE754 float
 SIZE_INTEGER = 3  # unsigned 16 bit integer
 
+# Layout of the measured values payload (CRC bytes stripped)
+MEASURED_VALUES_FLOAT = ">3f"
+
+
+class SCD30Record(Record):
+    __slots__ = ()
+
+    SENSOR = "SCD30"
+    FIELDS = ("CO2", "T", "RH")
+    UNITS = {
+        "CO2": "ppm",
+        "T": "°C",
+        "RH": "%"
+    }
+
+
 class SCD30:
 
-    def __init__(self, bus:int = 1, address:int = 0x61, sampling_period:int = 10, pressure:int = 960, logger:str = None):
+    def __init__(self, bus:int = 1, address:int = 0x61, sampling_period:int = 10, pressure:int = 960, logger:str = None, i2c=None, clock:Clock = None,
+                 capture:str = None, buffer_size:int = 300):
         self.logger = None
         if logger:
             self.logger = logging.getLogger(logger)
 
-        self.i2c = I2C(bus, address)
+        self.i2c = i2c if i2c else I2CBus.get(bus).device(address)
+        self.clock = clock if clock else Clock()
         self.sampling_period = sampling_period
         self.pressure = pressure
         self.crc = CRC()
-        self.__data = Queue(maxsize=20)
-#         self.__valid = False
-        self.__valid = {
-            "CO2": False,
-            "T": False,
-            "RH": False
-        }
+        self.decoder = FrameDecoder(MEASURED_VALUES_FLOAT)
+        self.record = SCD30Record
+        # capture mode: archive raw frames, decode later with common.capture.CaptureReader;
+        # the buffer then keeps raw frames too, decoded only when a consumer reads them
+        self.capture = CaptureWriter(capture, MEASURED_VALUES_FLOAT, SCD30Record, clock=self.clock) if capture else None
+        # decoded samples, oldest overwritten when consumers fall behind by buffer_size
+        self.__data = RingBuffer(buffer_size)
+        # subscribers get every sample pushed, off the acquisition worker
+        self.dispatcher = Dispatcher(logger=logger)
+        self.scheduler = ReadyScheduler(sampling_period, DATA_READY_INTERVAL)
+        self.engine = None
 
 
     def get_firmware_version(self) -> str:
-        self.i2c.write(CMD_GET_FIRMWARE_VERSION)
-        data = self.i2c.read(NBYTES_GET_FIRMWARE_VERSION)
+        data = self.i2c.transfer(CMD_GET_FIRMWARE_VERSION, NBYTES_GET_FIRMWARE_VERSION, READ_DELAY)
 
-        if self.crc.calc(data[:2]) != data[2]:
+        bad, payload = self.crc.validate_frame(data)
+        if bad:
             return "CRC mismatched"
 
-        return ".".join(map(str, data[:2]))
+        return ".".join(map(str, payload))
 
 
     def get_data_ready_flag(self) -> bool:
-        self.i2c.write(CMD_GET_DATA_READY_FLAG)
-        data = self.i2c.read(NBYTES_GET_DATA_READY_FLAG)
+        """True if a new sample is ready; None if the reply failed its CRC check."""
+        data = self.i2c.transfer(CMD_GET_DATA_READY_FLAG, NBYTES_GET_DATA_READY_FLAG, READ_DELAY, priority=PRIORITY_MEASUREMENT)
 
-        if self.crc.calc(data[:2]) != data[2]:
-            if self.logger:
-                self.logger.warning(
-                    "'get_data_ready_flag' CRC mismatched!" +
-                    f"  Data: {data[:2]}" +
-                    f"  Calculated CRC: {self.crc.calc(data[:2])}" +
-                    f"  Expected: {data[2]}")
-            else:
-                print(
-                    "'get_data_ready_flag' CRC mismatched!" +
-                    f"  Data: {data[:2]}" +
-                    f"  Calculated CRC: {self.crc.calc(data[:2])}" +
-                    f"  Expected: {data[2]}")
-
-            return False
+        bad, payload = self.crc.validate_frame(data)
+        if bad:
+            self.__crc_warning("get_data_ready_flag", data, bad)
+            return None
 
-        return True if data[1] == 1 else False
+        return True if payload[1] == 1 else False
 
 
     def reset(self) -> None:
@@ -114,219 +134,121 @@ class SCD30:
 
 
     def start_measurement(self) -> None:
-        data_format = {
-            "IEEE754_float": 0x03,
-            "unsigned_16_bit_integer": 0x05
-        }
-
-        data = CMD_START_MEASUREMENT
-        data.extend(self.pressure.to_bytes(2, 'big'))
+        data = CMD_START_MEASUREMENT + list(self.pressure.to_bytes(2, 'big'))
         data.append(self.crc.calc(data[2:4]))
         self.i2c.write(data)
-        sleep(0.05)
-        self.__run()
-
-    def get_measurement(self) -> dict:
-        if self.__data.empty():
-            return {}
-
-        return self.__data.get()
+        self.clock.sleep(0.05)
+        # all devices on a bus are polled by one worker thread
+        self.engine = AcquisitionEngine.get(getattr(self.i2c, "bus", self.i2c), self.clock)
+        self.engine.add(self)
+
+    def get_measurement(self) -> SCD30Record:
+        """Most recent sample, or None before the first read."""
+        return self.__record(self.__data.latest())
+
+    def drain(self) -> list:
+        """All samples read since the last drain, oldest first."""
+        entries = self.__data.drain()
+        if not self.capture:
+            return entries
+        return [record for record in map(self.__record, entries) if record is not None]
+
+    def wait_for_next(self, timeout: float = None) -> SCD30Record:
+        """Block until the next sample is read and return it; None after `timeout` s."""
+        if timeout is not None:
+            timeout /= self.clock.speedup
+        return self.__record(self.__data.wait_for_next(timeout))
+
+    def subscribe(self, callback) -> None:
+        """Call `callback(SCD30Record)` with every sample as soon as it was read."""
+        self.dispatcher.subscribe(callback)
+
+    def unsubscribe(self, callback) -> None:
+        self.dispatcher.unsubscribe(callback)
+
+    def get_buffer_stats(self) -> dict:
+        return self.__data.get_stats()
 
     def stop_measurement(self) -> None:
+        if self.engine:
+            self.engine.remove(self)
+            self.engine = None
         self.i2c.write(CMD_STOP_MEASUREMENT)
-        self.i2c.close()
-
-    def __ieee754_number_conversion(self, data:int) -> float:
-        binary = "{:032b}".format(data)
-
-        sign = int(binary[0:1])
-        exp = int(binary[1:9], 2) - 127
-
-        divider = 0
-        if exp < 0:
-            divider = abs(exp)
-            exp = 0
-
-        mantissa = binary[9:]
-
-        real = int(('1' + mantissa[:exp]), 2)
-        decimal = mantissa[exp:]
-
-        dec = 0.0
-        for i in range(len(decimal)):
-            dec += int(decimal[i]) / (2**(i+1))
+        self.close()
 
-        if divider == 0:
-            return round((((-1)**(sign) * real) + dec), 3)
-        else:
-            return round((((-1)**(sign) * real) + dec) / pow(2, divider), 3)
-
-
-    def __measurement(self, data:list) -> dict:
-        category = ["CO2", "T", "RH"]
-
-        readings = {
-            "CO2": 0.0,
-            "T": 0.0,
-            "RH": 0.0
-        }
-
-        for block, (x) in enumerate(category):
-            measured_data = []
-            for i in range(0, SIZE_FLOAT, PACKET_SIZE):
-                offset = (block * SIZE_FLOAT) + i
-                if self.crc.calc(data[offset:offset+2]) != data[offset+2]:
-                    if self.logger:
-                        self.logger.warning(
-                            "'__measurement' CRC mismatched!" +
-                            f"  Data: {data[offset:offset+2]}" +
-                            f"  Calculated CRC: {self.crc.calc(data[offset:offset+2])}" +
-                            f"  Expected: {data[offset+2]}")
-                    else:
-                        print(
-                            "'__measurement' CRC mismatched!" +
-                            f"  Data: {data[offset:offset+2]}" +
-                            f"  Calculated CRC: {self.crc.calc(data[offset:offset+2])}" +
-                            f"  Expected: {data[offset+2]}")
-#                     self.__valid = False
-                    self.__valid = {
-                        "CO2": True,
-#                         "T": True,
-#                         "RH": True
-                    }
-                    return {}
-
-                measured_data.extend(data[offset:offset+2])
-
-            readings[x] = self.__ieee754_number_conversion(
-                measured_data[0] << 24 | measured_data[1] << 16 | measured_data[2] << 8 | measured_data[3])
-
-#         self.__valid = True
-        self.__valid = {
-            "CO2": True,
-#             "T": True,
-#             "RH": True
-        }
-
-        return readings
-
-
-    def __CO2_measurement(self, data: list) -> float:
-        block = 0
-        size = []
-        for i in range(0, SIZE_FLOAT, PACKET_SIZE):
-            offset = (block * SIZE_FLOAT) + i
-            if self.crc.calc(data[offset:offset+2]) != data[offset+2]:          
-                if self.logger:
-                    self.logger.warning(self.__crc_warning('__CO2_measurement', data, offset))
-                else:
-                    print(self.__crc_warning('__CO2_measurement', data, offset))
-
-                self.__valid["CO2"] = False
-                return 0.0
-
-            size.extend(data[offset:offset+2])
-
-        self.__valid["CO2"] = True
-
-        return self.__ieee754_number_conversion(size[0] << 24 | size[1] << 16 | size[2] << 8 | size[3])
-
-
-    def __T_measurement(self, data: list) -> float:
-        block = 1
-        size = []
-        for i in range(0, SIZE_FLOAT, PACKET_SIZE):
-            offset = (block * SIZE_FLOAT) + i
-            if self.crc.calc(data[offset:offset+2]) != data[offset+2]:          
-                if self.logger:
-                    self.logger.warning(self.__crc_warning('__T_measurement', data, offset))
-                else:
-                    print(self.__crc_warning('__T_measurement', data, offset))
-
-                self.__valid["T"] = False
-                return 0.0
-
-            size.extend(data[offset:offset+2])
-
-        self.__valid["T"] = True
-
-        return self.__ieee754_number_conversion(size[0] << 24 | size[1] << 16 | size[2] << 8 | size[3])
-
-
-    def __RH_measurement(self, data: list) -> float:
-        block = 2
-        size = []
-        for i in range(0, SIZE_FLOAT, PACKET_SIZE):
-            offset = (block * SIZE_FLOAT) + i
-            if self.crc.calc(data[offset:offset+2]) != data[offset+2]:          
-                if self.logger:
-                    self.logger.warning(self.__crc_warning('__RH_measurement', data, offset))
-                else:
-                    print(self.__crc_warning('__RH_measurement', data, offset))
-
-                self.__valid["RH"] = False
-                return 0.0
-
-            size.extend(data[offset:offset+2])
-
-        self.__valid["RH"] = True
-
-        return self.__ieee754_number_conversion(size[0] << 24 | size[1] << 16 | size[2] << 8 | size[3])
-
-
-    def __crc_warning(self, label:str, data:list, offset:int):
+    def close(self) -> None:
+        """Release bus handle, subscribers and capture file, without sending a stop command."""
+        self.i2c.close()
+        self.dispatcher.shutdown()
+        if self.capture:
+            self.capture.close()
+
+    def __record(self, entry) -> SCD30Record:
+        # in capture mode, decode a buffered (time_ns, frame, monotonic_ns) entry; None if its CRC fails
+        if not self.capture or entry is None:
+            return entry
+        time_ns, data, monotonic_ns = entry
+        bad, values = self.decoder.decode(data)
+        if bad:
+            self.__crc_warning("capture", data, bad)
+            return None
+        return self.record(time_ns, values, monotonic_ns)
+
+    def __crc_warning(self, label:str, data:memoryview, bad:int) -> None:
+        words = [i for i in range(len(data) // PACKET_SIZE) if bad >> i & 1]
         warning = f"'{label}' CRC mismatched!"
-        warning += f" > Data: {data[offset:offset+2]}"
-        warning += f"  Calculated CRC: {self.crc.calc(data[offset:offset+2])}"
-        warning += f"  Expected: {data[offset+2]}"
-        return warning
+        warning += f" > Words: {words}"
+        warning += f"  Data: {list(data)}"
+        if self.logger:
+            self.logger.warning(warning)
+        else:
+            print(warning)
     
 
-    def __get_measured_value(self) -> None:
-        while True:
-            try:
-                if not self.get_data_ready_flag():
-                    continue
-
-                self.i2c.write(CMD_GET_MEASURED_VALUES)
-                data = self.i2c.read(NBYTES_MEASURED_VALUES_FLOAT)
-                
-                if self.__data.full():
-                    self.__data.get()
-
-                result = {
-                    "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "CO2": self.__CO2_measurement(data),
-                    "T": self.__T_measurement(data),
-                    "RH": self.__RH_measurement(data),
-                    "CO2_unit": "ppm",
-                    "RH_unit": "%",
-                    "T_unit": "°C"
-                    }
-
-                self.__data.put(result if all(self.__valid.values()) else {})
-
-            except KeyboardInterrupt:
-                if self.logger:
-                    self.logger.warning("Stopping measurement...")
-                else:
-                    print("Stopping measurement...")
-
-                self.stop_measurement()
-                sys.exit()
-
-            except Exception as err:
-                if self.logger:
-                    self.logger.warning(f"{type(err).__name__}: {err}")
-                else:
-                    print(f"{type(err).__name__}: {err}")
-
-            finally:
-                sleep(self.sampling_period)
-
-    def __run(self) -> None:
-        threading.Thread(target=self.__get_measured_value,
-                         daemon=True).start()
+    def poll(self) -> float:
+        """One data-ready check, and read if ready; returns the delay to the next poll, in s."""
+        try:
+            ready = self.get_data_ready_flag()
+            if ready is None:
+                # corrupted reply: a bus error, retried without counting as a miss
+                return self.scheduler.retry()
+            if not ready:
+                # retry shortly instead of sleeping a full period
+                return self.scheduler.miss(self.clock.monotonic())
+
+            data = self.i2c.transfer(CMD_GET_MEASURED_VALUES, self.decoder.nbytes, READ_DELAY, priority=PRIORITY_MEASUREMENT)
+            time_ns = self.clock.time_ns()
+            monotonic_ns = self.clock.monotonic_ns()
+            delay = self.scheduler.hit(monotonic_ns / 1e9)
+
+            if self.capture:
+                self.capture.append(time_ns, data)
+                entry = (time_ns, bytes(data), monotonic_ns)
+                self.__data.put(entry)
+                if self.dispatcher.subscribers:
+                    # subscribers are pushed every sample, so these frames are decoded right away
+                    record = self.__record(entry)
+                    if record is not None:
+                        self.dispatcher.publish(record)
+                return delay
+
+            bad, values = self.decoder.decode(data)
+            if bad:
+                self.__crc_warning("poll", data, bad)
+                return delay
+
+            record = self.record(time_ns, values, monotonic_ns)
+            self.__data.put(record)
+            self.dispatcher.publish(record)
+            return delay
+
+        except Exception as err:
+            if self.logger:
+                self.logger.warning(f"{type(err).__name__}: {err}")
+            else:
+                print(f"{type(err).__name__}: {err}")
+            return self.sampling_period
+
 
 if __name__ == "__main__":
     pass
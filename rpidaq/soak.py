@@ -0,0 +1,82 @@
+"""
+Soak test / benchmark of the SPS30 and SCD30 drivers against the emulated sensors.
+
+Example: one day of acquisition at 500x real time (about 3 minutes)
+    $ python soak.py --days 1 --speedup 500
+
+Host latency (thread wake-ups, GIL, garbage collection) is scaled up by the
+speedup as well: a 10 ms stall is 10 s of virtual time at 1000x, during which
+samples are overwritten unread. Depending on the host, results stop being
+representative somewhere between a few hundred and about 1000x, so the run
+compares the samples read with the number expected from the sensors' cadence
+and sampling period, and fails (exit status 1) if they differ by more than
+--tolerance in either direction: fewer means samples were missed, more means
+the drivers read faster than configured.
+"""
+
+import argparse
+import sys
+import time
+from common.clock import VirtualClock
+from common.emulator import emulated_bus, SPS30_ADDRESS, SCD30_ADDRESS
+from sps30.sps30 import SPS30
+from scd30.scd30 import SCD30
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run SPS30/SCD30 acquisition against emulated sensors.")
+    parser.add_argument("--days", type=float, default=1.0, help="Virtual duration in days.")
+    parser.add_argument("--speedup", type=float, default=500.0, help="Virtual clock speedup factor.")
+    parser.add_argument("--crc-error-rate", type=float, default=0.0, help="Fraction of corrupted CRC bytes.")
+    parser.add_argument("--report", type=float, default=3600.0, help="Report interval in virtual seconds.")
+    parser.add_argument("--tolerance", type=float, default=0.01, help="Allowed deviation from the expected sample count.")
+    args = parser.parse_args()
+
+    clock = VirtualClock(speedup=args.speedup)
+    bus = emulated_bus(clock, crc_error_rate=args.crc_error_rate)
+    pm_sensor = SPS30(i2c=bus.device(SPS30_ADDRESS), clock=clock)
+    co2_sensor = SCD30(i2c=bus.device(SCD30_ADDRESS), clock=clock)
+    print(f"SPS30 {pm_sensor.get_product_type()} {pm_sensor.get_serial_number()} {pm_sensor.get_firmware_version()}")
+    print(f"SCD30 firmware {co2_sensor.get_firmware_version()}")
+
+    pm_sensor.start_measurement()
+    co2_sensor.start_measurement()
+
+    t0 = time.process_time()
+    start = clock.monotonic()
+    end = start + args.days * 86400
+    while clock.monotonic() < end:
+        clock.sleep(args.report)
+        pm_result = pm_sensor.get_measurement()
+        print(f"{pm_result.isoformat() if pm_result else None} {bus.get_stats()} cpu={time.process_time() - t0:.1f}s")
+
+    engine = pm_sensor.engine.get_stats()
+    elapsed = clock.monotonic() - start
+    pm_sensor.stop_measurement()
+    co2_sensor.stop_measurement()
+    print(f"acquisition: {engine}")
+    print(f"SPS30 polls: {pm_sensor.scheduler.get_stats()}")
+    print(f"SCD30 polls: {co2_sensor.scheduler.get_stats()}")
+    print(f"SPS30 buffer: {pm_sensor.get_buffer_stats()}")
+    print(f"SCD30 buffer: {co2_sensor.get_buffer_stats()}")
+    print(f"done: cpu={time.process_time() - t0:.1f}s")
+
+    # frames read off the bus (whether or not their CRC passed) against the sensor's output over the run
+    failed = False
+    for name, sensor in (("SPS30", pm_sensor), ("SCD30", co2_sensor)):
+        scheduler = sensor.scheduler
+        expected = elapsed / max(scheduler.period, scheduler.nominal)
+        deviation = scheduler.hits / expected - 1
+        print(f"{name}: read {scheduler.hits} of ~{expected:.0f} samples ({deviation:+.2%})")
+        if deviation < -args.tolerance:
+            print(f"FAILED: {name} missed samples (try a lower --speedup)")
+            failed = True
+        elif deviation > args.tolerance:
+            print(f"FAILED: {name} read faster than its sampling period")
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
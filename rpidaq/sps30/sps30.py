@@ -26,14 +26,17 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
-import sys
-import threading
 import logging
-from time import sleep
-from queue import Queue
-from datetime import datetime
-from common.i2c import I2C
+from common.bus import I2CBus, PRIORITY_MEASUREMENT
+from common.clock import Clock
 from common.crc import CRC
+from common.decode import FrameDecoder
+from common.records import Record
+from common.capture import CaptureWriter
+from common.ring import RingBuffer
+from common.dispatch import Dispatcher
+from common.scheduler import ReadyScheduler
+from common.acquisition import AcquisitionEngine
 
 # I2C commands
 CMD_START_MEASUREMENT = [0x00, 0x10]
@@ -61,6 +64,9 @@ NBYTES_GET_SERIAL_NUMBER = 48
 NBYTES_GET_FIRMWARE_VERSION = 3
 NBYTES_GET_STATUS_REGISTER = 6
 
+# The SPS30 updates its measured values every second, in s
+DATA_READY_INTERVAL = 1.0
+
 # Packet size including checksum byte [data1, data2, checksum]
 PACKET_SIZE = 3
 
@@ -68,71 +74,114 @@ PACKET_SIZE = 3
 SIZE_FLOAT = 6  # IEEE754 float
 SIZE_INTEGER = 3  # unsigned 16 bit integer
 
+# Output formats of the measured values, selected by start_measurement
+DATA_FORMAT = {
+    "IEEE754_float": 0x03,
+    "unsigned_16_bit_integer": 0x05
+}
+
+# Layout of the measured values payload (CRC bytes stripped) per output format.
+# The integer format needs 30 instead of 60 bytes per sample on the bus.
+MEASURED_VALUES = {
+    "IEEE754_float": ">10f",
+    "unsigned_16_bit_integer": ">10H"
+}
+
+
+class SPS30Record(Record):
+    __slots__ = ()
+
+    SENSOR = "SPS30"
+    FIELDS = (
+        "mass_density_pm1.0", "mass_density_pm2.5", "mass_density_pm4.0", "mass_density_pm10",
+        "particle_count_pm0.5", "particle_count_pm1.0", "particle_count_pm2.5", "particle_count_pm4.0",
+        "particle_count_pm10",
+        "particle_size"
+    )
+    UNITS = {
+        **dict.fromkeys(FIELDS[:4], "μg/m3"),
+        **dict.fromkeys(FIELDS[4:9], "#/cm3"),
+        "particle_size": "μm"
+    }
+
+
+class SPS30IntegerRecord(SPS30Record):
+    __slots__ = ()
+
+    # The integer format reports the typical particle size in nm
+    UNITS = {**SPS30Record.UNITS, "particle_size": "nm"}
+
+
+# Record type per output format
+RECORD = {
+    "IEEE754_float": SPS30Record,
+    "unsigned_16_bit_integer": SPS30IntegerRecord
+}
+
+
 class SPS30:
 
-    def __init__(self,  bus:int = 1, address:int = 0x69, sampling_period:int = 1, logger:str = None):
+    def __init__(self,  bus:int = 1, address:int = 0x69, sampling_period:int = 1, logger:str = None, i2c=None, clock:Clock = None,
+                 data_format:str = "IEEE754_float", capture:str = None, buffer_size:int = 300):
         self.logger = None
         if logger:
             self.logger = logging.getLogger(logger)
 
         self.sampling_period = sampling_period
-        self.i2c = I2C(bus, address)
+        self.i2c = i2c if i2c else I2CBus.get(bus).device(address)
+        self.clock = clock if clock else Clock()
         self.crc = CRC()
-        self.__data = Queue(maxsize=20)
-        self.__valid = {
-            "mass_density": False,
-            "particle_count": False,
-            "particle_size": False
-        }
+        if data_format not in DATA_FORMAT:
+            raise ValueError(f"Unknown data format '{data_format}', expected one of {list(DATA_FORMAT)}")
+        self.data_format = data_format
+        self.decoder = FrameDecoder(MEASURED_VALUES[data_format])
+        self.record = RECORD[data_format]
+        # capture mode: archive raw frames, decode later with common.capture.CaptureReader;
+        # the buffer then keeps raw frames too, decoded only when a consumer reads them
+        self.capture = CaptureWriter(capture, MEASURED_VALUES[data_format], self.record, clock=self.clock) if capture else None
+        # decoded samples, oldest overwritten when consumers fall behind by buffer_size
+        self.__data = RingBuffer(buffer_size)
+        # subscribers get every sample pushed, off the acquisition worker
+        self.dispatcher = Dispatcher(logger=logger)
+        self.scheduler = ReadyScheduler(sampling_period, DATA_READY_INTERVAL)
+        self.engine = None
 
 
     def get_firmware_version(self) -> str:
-        self.i2c.write(CMD_GET_FIRMWARE_VERSION)
-        data = self.i2c.read(NBYTES_GET_FIRMWARE_VERSION)
+        data = self.i2c.transfer(CMD_GET_FIRMWARE_VERSION, NBYTES_GET_FIRMWARE_VERSION)
 
-        if self.crc.calc(data[:2]) != data[2]:
+        bad, payload = self.crc.validate_frame(data)
+        if bad:
             return "CRC mismatched"
 
-        return ".".join(map(str, data[:2]))
+        return ".".join(map(str, payload))
 
     def get_product_type(self) -> str:
-        self.i2c.write(CMD_GET_PRODUCT_TYPE)
-        data = self.i2c.read(NBYTES_GET_PRODUCT_TYPE)
-        result = ""
-
-        for i in range(0, NBYTES_GET_PRODUCT_TYPE, 3):
-            if self.crc.calc(data[i:i+2]) != data[i+2]:
-                return "CRC mismatched"
+        data = self.i2c.transfer(CMD_GET_PRODUCT_TYPE, NBYTES_GET_PRODUCT_TYPE)
+        bad, payload = self.crc.validate_frame(data)
+        if bad:
+            return "CRC mismatched"
 
-            result += "".join(map(chr, data[i:i+2]))
+        result = "".join(map(chr, payload))
         if result == "00080000":
             result = "SPS30"
             
         return result
 
     def get_serial_number(self) -> str:
-        self.i2c.write(CMD_GET_SERIAL_NUMBER)
-        data = self.i2c.read(NBYTES_GET_SERIAL_NUMBER)
-        result = ""
-
-        for i in range(0, NBYTES_GET_SERIAL_NUMBER, PACKET_SIZE):
-            if self.crc.calc(data[i:i+2]) != data[i+2]:
-                return "CRC mismatched"
-
-            result += "".join(map(chr, data[i:i+2]))
+        data = self.i2c.transfer(CMD_GET_SERIAL_NUMBER, NBYTES_GET_SERIAL_NUMBER)
+        bad, payload = self.crc.validate_frame(data)
+        if bad:
+            return "CRC mismatched"
 
-        return result
+        return "".join(map(chr, payload))
 
     def get_status_register(self) -> dict:
-        self.i2c.write(CMD_GET_STATUS_REGISTER)
-        data = self.i2c.read(NBYTES_GET_STATUS_REGISTER)
-
-        status = []
-        for i in range(0, NBYTES_GET_STATUS_REGISTER, PACKET_SIZE):
-            if self.crc.calc(data[i:i+2]) != data[i+2]:
-                return "CRC mismatched"
+        data = self.i2c.transfer(CMD_GET_STATUS_REGISTER, NBYTES_GET_STATUS_REGISTER)
 
-            status.extend(data[i:i+2])
+        bad, status = self.crc.validate_frame(data)
+        if bad:
+            return "CRC mismatched"
 
         binary = '{:032b}'.format(
             status[0] << 24 | status[1] << 16 | status[2] << 8 | status[3])
@@ -152,26 +201,15 @@ class SPS30:
 
 
     def get_data_ready_flag(self) -> bool:
-        self.i2c.write(CMD_GET_DATA_READY_FLAG)
-        data = self.i2c.read(NBYTES_GET_DATA_READY_FLAG)
-
-        if self.crc.calc(data[:2]) != data[2]:
-            if self.logger:
-                self.logger.warning(
-                    "'get_data_ready_flag' CRC mismatched!" +
-                    f"  Data: {data[:2]}" +
-                    f"  Calculated CRC: {self.crc.calc(data[:2])}" +
-                    f"  Expected: {data[2]}")
-            else:
-                print(
-                    "'get_data_ready_flag' CRC mismatched!" +
-                    f"  Data: {data[:2]}" +
-                    f"  Calculated CRC: {self.crc.calc(data[:2])}" +
-                    f"  Expected: {data[2]}")
+        """True if a new sample is ready; None if the reply failed its CRC check."""
+        data = self.i2c.transfer(CMD_GET_DATA_READY_FLAG, NBYTES_GET_DATA_READY_FLAG, priority=PRIORITY_MEASUREMENT)
 
-            return False
+        bad, payload = self.crc.validate_frame(data)
+        if bad:
+            self.__crc_warning("get_data_ready_flag", data, bad)
+            return None
 
-        return True if data[1] == 1 else False
+        return True if payload[1] == 1 else False
 
 
     def sleep(self) -> None:
@@ -187,15 +225,11 @@ class SPS30:
 
 
     def get_auto_cleaning_interval(self) -> int:
-        self.i2c.write(CMD_GET_AUTO_CLEANING_INTERVAL)
-        data = self.i2c.read(NBYTES_GET_AUTO_CLEANING_INTERVAL)
+        data = self.i2c.transfer(CMD_GET_AUTO_CLEANING_INTERVAL, NBYTES_GET_AUTO_CLEANING_INTERVAL)
 
-        interval = []
-        for i in range(0, NBYTES_GET_AUTO_CLEANING_INTERVAL, 3):
-            if self.crc.calc(data[i:i+2]) != data[i+2]:
-                return "CRC mismatched"
-
-            interval.extend(data[i:i+2])
+        bad, interval = self.crc.validate_frame(data)
+        if bad:
+            return "CRC mismatched"
 
         return (interval[0] << 24 | interval[1] << 16 | interval[2] << 8 | interval[3])
 
@@ -213,7 +247,7 @@ class SPS30:
         data.extend([interval[2], interval[3]])
         data.append(self.crc.calc(data[5:7]))
         self.i2c.write(data)
-        sleep(0.05)
+        self.clock.sleep(0.05)
         return self.get_auto_cleaning_interval()
 
 
@@ -222,212 +256,123 @@ class SPS30:
 
 
     def start_measurement(self) -> None:
-        data_format = {
-            "IEEE754_float": 0x03,
-            "unsigned_16_bit_integer": 0x05
-        }
-
-        data = CMD_START_MEASUREMENT
-        data.extend([data_format["IEEE754_float"], 0x00])
+        data = CMD_START_MEASUREMENT + [DATA_FORMAT[self.data_format], 0x00]
         data.append(self.crc.calc(data[2:4]))
         self.i2c.write(data)
-        sleep(0.05)
-        self.__run()
-
+        self.clock.sleep(0.05)
+        # all devices on a bus are polled by one worker thread
+        self.engine = AcquisitionEngine.get(getattr(self.i2c, "bus", self.i2c), self.clock)
+        self.engine.add(self)
 
-    def get_measurement(self) -> dict:
-        if self.__data.empty():
-            return {}
 
-        return self.__data.get()
+    def get_measurement(self) -> SPS30Record:
+        """Most recent sample, or None before the first read."""
+        return self.__record(self.__data.latest())
 
+    def drain(self) -> list:
+        """All samples read since the last drain, oldest first."""
+        entries = self.__data.drain()
+        if not self.capture:
+            return entries
+        return [record for record in map(self.__record, entries) if record is not None]
 
-    def stop_measurement(self) -> None:
-        self.i2c.write(CMD_STOP_MEASUREMENT)
-        self.i2c.close()
+    def wait_for_next(self, timeout: float = None) -> SPS30Record:
+        """Block until the next sample is read and return it; None after `timeout` s."""
+        if timeout is not None:
+            timeout /= self.clock.speedup
+        return self.__record(self.__data.wait_for_next(timeout))
 
+    def subscribe(self, callback) -> None:
+        """Call `callback(SPS30Record)` with every sample as soon as it was read."""
+        self.dispatcher.subscribe(callback)
 
-    def __ieee754_number_conversion(self, data: int) -> float:
-        binary = "{:032b}".format(data)
+    def unsubscribe(self, callback) -> None:
+        self.dispatcher.unsubscribe(callback)
 
-        sign = int(binary[0:1])
-        exp = int(binary[1:9], 2) - 127
+    def get_buffer_stats(self) -> dict:
+        return self.__data.get_stats()
 
-        divider = 0
-        if exp < 0:
-            divider = abs(exp)
-            exp = 0
-
-        mantissa = binary[9:]
-
-        real = int(('1' + mantissa[:exp]), 2)
-        decimal = mantissa[exp:]
+    def stop_measurement(self) -> None:
+        if self.engine:
+            self.engine.remove(self)
+            self.engine = None
+        self.i2c.write(CMD_STOP_MEASUREMENT)
+        self.close()
 
-        dec = 0.0
-        for i in range(len(decimal)):
-            dec += int(decimal[i]) / (2**(i+1))
 
-        if divider == 0:
-            return round((((-1)**(sign) * real) + dec), 3)
+    def close(self) -> None:
+        """Release bus handle, subscribers and capture file, without sending a stop command."""
+        self.i2c.close()
+        self.dispatcher.shutdown()
+        if self.capture:
+            self.capture.close()
+
+
+    def __record(self, entry) -> SPS30Record:
+        # in capture mode, decode a buffered (time_ns, frame, monotonic_ns) entry; None if its CRC fails
+        if not self.capture or entry is None:
+            return entry
+        time_ns, data, monotonic_ns = entry
+        bad, values = self.decoder.decode(data)
+        if bad:
+            self.__crc_warning("capture", data, bad)
+            return None
+        return self.record(time_ns, values, monotonic_ns)
+
+    def __crc_warning(self, label: str, data: memoryview, bad: int) -> None:
+        words = [i for i in range(len(data) // PACKET_SIZE) if bad >> i & 1]
+        warning = f"'{label}' CRC mismatched!"
+        warning += f" > Words: {words}"
+        warning += f"  Data: {list(data)}"
+        if self.logger:
+            self.logger.warning(warning)
         else:
-            return round((((-1)**(sign) * real) + dec) / pow(2, divider), 3)
-
-
-    def __mass_density_measurement(self, data: list) -> dict:
-        category = ["pm1.0", "pm2.5", "pm4.0", "pm10"]
-
-        density = {
-            "pm1.0": 0.0,
-            "pm2.5": 0.0,
-            "pm4.0": 0.0,
-            "pm10": 0.0
-        }
-
-        for block, (pm) in enumerate(category):
-            pm_data = []
-            for i in range(0, SIZE_FLOAT, PACKET_SIZE):
-                offset = (block * SIZE_FLOAT) + i
-                if self.crc.calc(data[offset:offset+2]) != data[offset+2]:
-                    if self.logger:
-                        self.logger.warning(
-                            "'__mass_density_measurement' CRC mismatched!" +
-                            f"  Data: {data[offset:offset+2]}" +
-                            f"  Calculated CRC: {self.crc.calc(data[offset:offset+2])}" +
-                            f"  Expected: {data[offset+2]}")
-                    else:
-                        print(
-                            "'__mass_density_measurement' CRC mismatched!" +
-                            f"  Data: {data[offset:offset+2]}" +
-                            f"  Calculated CRC: {self.crc.calc(data[offset:offset+2])}" +
-                            f"  Expected: {data[offset+2]}")
-                    self.__valid["mass_density"] = False
-                    return {}
-
-                pm_data.extend(data[offset:offset+2])
-
-            density[pm] = self.__ieee754_number_conversion(
-                pm_data[0] << 24 | pm_data[1] << 16 | pm_data[2] << 8 | pm_data[3])
-
-        self.__valid["mass_density"] = True
-
-        return density
-
-
-    def __particle_count_measurement(self, data: list) -> dict:
-        category = ["pm0.5", "pm1.0", "pm2.5", "pm4.0", "pm10"]
-
-        count = {
-            "pm0.5": 0.0,
-            "pm1.0": 0.0,
-            "pm2.5": 0.0,
-            "pm4.0": 0.0,
-            "pm10": 0.0
-        }
-
-        for block, (pm) in enumerate(category):
-            pm_data = []
-            for i in range(0, SIZE_FLOAT, PACKET_SIZE):
-                offset = (block * SIZE_FLOAT) + i
-                if self.crc.calc(data[offset:offset+2]) != data[offset+2]:
-                    if self.logger:
-                        self.logger.warning(
-                            "'__particle_count_measurement' CRC mismatched!" +
-                            f"  Data: {data[offset:offset+2]}" +
-                            f"  Calculated CRC: {self.crc.calc(data[offset:offset+2])}" +
-                            f"  Expected: {data[offset+2]}")
-                    else:
-                        print(
-                            "'__particle_count_measurement' CRC mismatched!" +
-                            f"  Data: {data[offset:offset+2]}" +
-                            f"  Calculated CRC: {self.crc.calc(data[offset:offset+2])}" +
-                            f"  Expected: {data[offset+2]}")
-
-                    self.__valid["particle_count"] = False
-                    return {}
-
-                pm_data.extend(data[offset:offset+2])
-
-            count[pm] = self.__ieee754_number_conversion(
-                pm_data[0] << 24 | pm_data[1] << 16 | pm_data[2] << 8 | pm_data[3])
-
-        self.__valid["particle_count"] = True
-
-        return count
-
-
-    def __particle_size_measurement(self, data: list) -> float:
-        size = []
-        for i in range(0, SIZE_FLOAT, PACKET_SIZE):
-            if self.crc.calc(data[i:i+2]) != data[i+2]:
-                if self.logger:
-                    self.logger.warning(
-                        "'__particle_size_measurement' CRC mismatched!" +
-                        f"  Data: {data[i:i+2]}" +
-                        f"  Calculated CRC: {self.crc.calc(data[i:i+2])}" +
-                        f"  Expected: {data[i+2]}")
-                else:
-                    print(
-                        "'__particle_size_measurement' CRC mismatched!" +
-                        f"  Data: {data[i:i+2]}" +
-                        f"  Calculated CRC: {self.crc.calc(data[i:i+2])}" +
-                        f"  Expected: {data[i+2]}")
-
-                self.__valid["particle_size"] = False
-                return 0.0
-
-            size.extend(data[i:i+2])
-
-        self.__valid["particle_size"] = True
-
-        return self.__ieee754_number_conversion(size[0] << 24 | size[1] << 16 | size[2] << 8 | size[3])
-
-
-    def __get_measured_value(self) -> None:
-        while True:
-            try:
-                if not self.get_data_ready_flag():
-                    continue
-
-                self.i2c.write(CMD_GET_MEASURED_VALUES)
-                data = self.i2c.read(NBYTES_MEASURED_VALUES_FLOAT)
-
-                if self.__data.full():
-                    self.__data.get()
-
-                result = {
-                    "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "mass_density": self.__mass_density_measurement(data[:24]),
-                    "particle_count": self.__particle_count_measurement(data[24:54]),
-                    "particle_size": self.__particle_size_measurement(data[54:]),
-                    "mass_density_unit": "μg/m3",
-                    "particle_count_unit": "#/cm3",
-                    "particle_size_unit": "μm"
-                }
-
-                self.__data.put(result if all(self.__valid.values()) else {})
-
-            except KeyboardInterrupt:
-                if self.logger:
-                    self.logger.warning("Stopping measurement...")
-                else:
-                    print("Stopping measurement...")
-
-                self.stop_measurement()
-                sys.exit()
-
-            except Exception as e:
-                if self.logger:
-                    self.logger.warning(f"{type(e).__name__}: {e}")
-                else:
-                    print(f"{type(e).__name__}: {e}")
-
-            finally:
-                sleep(self.sampling_period)
-
-
-    def __run(self) -> None:
-        threading.Thread(target=self.__get_measured_value,
-                         daemon=True).start()
+            print(warning)
+
+
+    def poll(self) -> float:
+        """One data-ready check, and read if ready; returns the delay to the next poll, in s."""
+        try:
+            ready = self.get_data_ready_flag()
+            if ready is None:
+                # corrupted reply: a bus error, retried without counting as a miss
+                return self.scheduler.retry()
+            if not ready:
+                # retry shortly instead of sleeping a full period
+                return self.scheduler.miss(self.clock.monotonic())
+
+            data = self.i2c.transfer(CMD_GET_MEASURED_VALUES, self.decoder.nbytes, priority=PRIORITY_MEASUREMENT)
+            time_ns = self.clock.time_ns()
+            monotonic_ns = self.clock.monotonic_ns()
+            delay = self.scheduler.hit(monotonic_ns / 1e9)
+
+            if self.capture:
+                self.capture.append(time_ns, data)
+                entry = (time_ns, bytes(data), monotonic_ns)
+                self.__data.put(entry)
+                if self.dispatcher.subscribers:
+                    # subscribers are pushed every sample, so these frames are decoded right away
+                    record = self.__record(entry)
+                    if record is not None:
+                        self.dispatcher.publish(record)
+                return delay
+
+            bad, values = self.decoder.decode(data)
+            if bad:
+                self.__crc_warning("poll", data, bad)
+                return delay
+
+            record = self.record(time_ns, values, monotonic_ns)
+            self.__data.put(record)
+            self.dispatcher.publish(record)
+            return delay
+
+        except Exception as err:
+            if self.logger:
+                self.logger.warning(f"{type(err).__name__}: {err}")
+            else:
+                print(f"{type(err).__name__}: {err}")
+            return self.sampling_period
 
 
 if __name__ == "__main__":
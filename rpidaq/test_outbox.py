@@ -0,0 +1,122 @@
+"""
+Checks of the durable MQTT outbox (common.outbox.Outbox) in a temporary directory, no broker needed.
+
+    $ python test_outbox.py      (or pytest test_outbox.py)
+"""
+
+import os
+import tempfile
+from common.outbox import Outbox, ENTRY
+
+
+def payload(i: int) -> bytes:
+    return f"message {i:04d}".encode() * 3
+
+
+def segments(directory: str) -> list:
+    return sorted(name for name in os.listdir(directory) if name.endswith(".seg"))
+
+
+def test_put_ack():
+    with tempfile.TemporaryDirectory() as directory:
+        # two entries per segment
+        outbox = Outbox(directory, segment_size=2 * (ENTRY.size + len(payload(0))), fsync=False)
+        ids = [outbox.put(payload(i)) for i in range(6)]
+        assert ids == [1, 2, 3, 4, 5, 6]
+        assert outbox.pending(2) == [(1, payload(0)), (2, payload(1))]
+
+        for entry_id in ids[:4]:
+            outbox.ack(entry_id)
+        # repeated and unknown acknowledgements are ignored
+        outbox.ack(4)
+        outbox.ack(99)
+        assert [entry_id for entry_id, _ in outbox.pending()] == [5, 6]
+        assert outbox.get_stats()["acked"] == 4
+        # the fully acknowledged segments are gone
+        assert len(segments(directory)) == outbox.get_stats()["segments"] == 1
+        outbox.close()
+
+
+def test_reload():
+    with tempfile.TemporaryDirectory() as directory:
+        outbox = Outbox(directory, fsync=False)
+        for i in range(5):
+            outbox.put(payload(i))
+        outbox.ack(2)
+        outbox.ack(4)
+        outbox.close()
+
+        # restart: unacknowledged entries are handed out again, ids continue
+        outbox = Outbox(directory, fsync=False)
+        assert outbox.pending() == [(1, payload(0)), (3, payload(2)), (5, payload(4))]
+        assert outbox.put(payload(5)) == 6
+        for entry_id in (1, 3, 5, 6):
+            outbox.ack(entry_id)
+        outbox.close()
+
+        # everything delivered: nothing left to replay, no segments left over
+        outbox = Outbox(directory, fsync=False)
+        assert outbox.pending() == [] and len(outbox) == 0
+        assert segments(directory) == []
+        outbox.close()
+
+
+def test_torn_entry():
+    with tempfile.TemporaryDirectory() as directory:
+        outbox = Outbox(directory, fsync=False)
+        for i in range(3):
+            outbox.put(payload(i))
+        outbox.close()
+        path = os.path.join(directory, segments(directory)[-1])
+        size = os.path.getsize(path)
+
+        # power cut in the middle of the next entry
+        with open(path, "ab") as fh:
+            fh.write(ENTRY.pack(4, len(payload(3)), 0) + payload(3)[:5])
+        outbox = Outbox(directory, fsync=False)
+        assert os.path.getsize(path) == size
+        assert [entry_id for entry_id, _ in outbox.pending()] == [1, 2, 3]
+        assert outbox.put(payload(3)) == 4
+        assert outbox.pending()[-1] == (4, payload(3))
+        outbox.close()
+
+        # a complete entry whose payload fails its CRC is cut off as well
+        outbox = Outbox(directory, fsync=False)
+        path = os.path.join(directory, segments(directory)[-1])
+        size = os.path.getsize(path)
+        with open(path, "ab") as fh:
+            fh.write(ENTRY.pack(5, len(payload(4)), 0) + payload(4))
+        outbox.close()
+        outbox = Outbox(directory, fsync=False)
+        assert os.path.getsize(path) == size
+        assert [entry_id for entry_id, _ in outbox.pending()] == [1, 2, 3, 4]
+        outbox.close()
+
+
+def test_eviction():
+    with tempfile.TemporaryDirectory() as directory:
+        entry_size = ENTRY.size + len(payload(0))
+        # two entries per segment, room for three segments
+        outbox = Outbox(directory, segment_size=2 * entry_size, max_bytes=6 * entry_size, fsync=False)
+        for i in range(20):
+            outbox.put(payload(i))
+        stats = outbox.get_stats()
+        assert stats["bytes"] <= 6 * entry_size
+        assert stats["evicted"] == 20 - stats["pending"] == 14
+        # the oldest entries went first
+        assert [entry_id for entry_id, _ in outbox.pending()] == list(range(15, 21))
+
+        # acknowledging an evicted entry changes nothing
+        outbox.ack(1)
+        assert outbox.get_stats()["evicted"] == 14 and outbox.acked == 0
+        outbox.close()
+
+        outbox = Outbox(directory, fsync=False)
+        assert [entry_id for entry_id, _ in outbox.pending()] == list(range(15, 21))
+        outbox.close()
+
+
+if __name__ == "__main__":
+    for test in (test_put_ack, test_reload, test_torn_entry, test_eviction):
+        test()
+        print(f"{test.__name__}: ok")
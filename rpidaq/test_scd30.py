@@ -25,7 +25,6 @@ SOFTWARE.
 """
 
 import sys
-import json
 from time import sleep
 from scd30.scd30 import SCD30
 
@@ -39,7 +38,9 @@ if __name__ == "__main__":
     
     while True:
         try:
-            print(json.dumps(c02_sensor.get_measurement(), indent=2))
+            result = c02_sensor.get_measurement()
+            if result:
+                print(result.to_json(3, indent=2))
             sleep(scd30_sampling_period)
 
         except KeyboardInterrupt:
@@ -0,0 +1,94 @@
+"""
+Deterministic checks of ReadyScheduler (against a simulated data-ready flag) and of periodic Task deadlines, no hardware needed.
+
+    $ python test_scheduler.py      (or pytest test_scheduler.py)
+"""
+
+import random
+from common.scheduler import ReadyScheduler, Task, MAX_SLEEP
+
+
+def simulate(interval: float, nominal: float = 1.0, crc_error_rate: float = 0.0, phase: float = 0.3,
+             duration: float = 20000.0, read_time: float = 0.003, seed: int = 1, period: float = 1.0):
+    """Poll a device with a new sample every `interval` s; returns the scheduler, the fraction of samples read and the read times."""
+    rng = random.Random(seed)
+    scheduler = ReadyScheduler(period, nominal)
+    now = 0.0
+    last_read = -1
+    samples = 0
+    reads = []
+    while now < duration:
+        ready = int((now - phase) // interval)
+        if rng.random() < crc_error_rate:
+            delay = scheduler.retry()
+        elif ready > last_read:
+            last_read = ready
+            samples += 1
+            reads.append(now + read_time)
+            delay = scheduler.hit(now + read_time)
+        else:
+            delay = scheduler.miss(now)
+        now += read_time + delay
+    return scheduler, samples / ((duration - phase) // interval), reads
+
+
+def test_nominal():
+    scheduler, fraction, _ = simulate(1.0)
+    assert abs(scheduler.interval - 1.0) < 0.01
+    assert fraction > 0.999
+    assert scheduler.get_stats()["poll_ratio"] < 1.2
+
+
+def test_crc_errors():
+    # corrupted data-ready replies must not drag the learned cadence up
+    for seed in range(5):
+        scheduler, fraction, _ = simulate(1.0, crc_error_rate=0.02, seed=seed)
+        assert abs(scheduler.interval - 1.0) < 0.01, scheduler.get_stats()
+        assert fraction > 0.995, fraction
+
+
+def test_drift():
+    # device oscillator 2 % slow or fast against the nominal cadence
+    for interval in (0.98, 1.02):
+        scheduler, fraction, _ = simulate(interval)
+        assert abs(scheduler.interval - interval) < 0.01, scheduler.get_stats()
+        assert fraction > 0.995, fraction
+
+
+def test_clamped():
+    # a device far off its nominal cadence cannot pull the estimate out of the tolerance band
+    scheduler, _, _ = simulate(1.5)
+    assert scheduler.interval <= 1.0 * (1 + scheduler.tolerance) + 1e-9
+
+
+def test_decimated():
+    # sampling period longer than the device cadence (SCD30 default: 10 s against 2 s): an older sample is
+    # always waiting, which must neither be taken for a late prediction nor shorten the reads' spacing
+    for period, interval in ((10.0, 2.0), (3.0, 2.0), (10.0, 2.04)):
+        scheduler, _, reads = simulate(interval, nominal=2.0, period=period)
+        gaps = [b - a for a, b in zip(reads, reads[1:])]
+        assert min(gaps) >= period, (period, interval, min(gaps))
+        assert max(gaps) < period + interval, (period, interval, max(gaps))
+
+
+def test_task_deadlines():
+    task = Task("minute", 60, None)
+    assert task.delay(1000.0) == MAX_SLEEP
+    assert task.deadline == 1020.0
+    assert task.delay(1020.5) == 0.0
+    task.begin(1020.5)
+    task.end(1021.0)
+    assert task.deadline == 1080.0
+    # overran two deadlines
+    task.begin(1080.0)
+    task.end(1205.0)
+    assert (task.deadline, task.overruns, task.skipped) == (1260.0, 1, 2)
+    # wall clock set back by an hour: realigned, and sleeps stay short
+    assert task.delay(1260.0 - 3600) == MAX_SLEEP
+    assert task.deadline == 1260.0 - 3600 + 60
+
+
+if __name__ == "__main__":
+    for test in (test_nominal, test_crc_errors, test_drift, test_clamped, test_decimated, test_task_deadlines):
+        test()
+        print(f"{test.__name__}: ok")
@@ -0,0 +1,126 @@
+"""
+Checks of the shared-memory sample ring (common.shm.SharedRing) within one process, no sensors or emulator needed.
+
+    $ python test_shm.py      (or pytest test_shm.py)
+"""
+
+import os
+import itertools
+from common.records import Record
+from common.shm import SharedRing
+
+names = itertools.count()
+
+
+class Sample(Record):
+    __slots__ = ()
+
+    SENSOR = "TEST"
+    FIELDS = ("i",)
+
+
+def sample(i: int) -> Sample:
+    return Sample(1_000_000_000 * i, (float(i),), i)
+
+
+def open_ring(capacity: int) -> tuple:
+    """Writer and reader of a new ring."""
+    name = f"rpidaq-test-{os.getpid()}-{next(names)}"
+    writer = SharedRing(name, Sample, "<d", capacity=capacity, create=True)
+    reader = SharedRing(name, Sample, "<d")
+    return writer, reader
+
+
+def close_ring(writer: SharedRing, reader: SharedRing) -> None:
+    reader.close()
+    writer.close(unlink=True)
+
+
+def values(records: list) -> list:
+    return [int(record["i"]) for record in records]
+
+
+def test_drain():
+    writer, reader = open_ring(8)
+    try:
+        assert reader.get_measurement() is None and reader.drain() == []
+        for i in range(5):
+            writer.put(sample(i))
+        records = reader.drain()
+        assert values(records) == [0, 1, 2, 3, 4]
+        assert (records[2].time_ns, records[2].monotonic_ns) == (2_000_000_000, 2)
+        assert reader.drain() == []
+        writer.put(sample(5))
+        assert values(reader.drain()) == [5]
+        assert values([reader.get_measurement()]) == [5]
+        assert reader.overruns == 0
+
+        # a reader attaching later starts at the current count
+        late = SharedRing(writer.name, Sample, "<d")
+        writer.put(sample(6))
+        assert values(late.drain()) == [6]
+        late.close()
+    finally:
+        close_ring(writer, reader)
+
+
+def test_lapped():
+    # the writer got more than a ring ahead between two drains
+    writer, reader = open_ring(8)
+    try:
+        for i in range(20):
+            writer.put(sample(i))
+        # the slot of sample 12 is the one the writer would overwrite next, so it is not trusted
+        assert values(reader.drain()) == list(range(13, 20))
+        assert reader.overruns == 13
+        writer.put(sample(20))
+        assert values(reader.drain()) == [20]
+        assert reader.overruns == 13
+    finally:
+        close_ring(writer, reader)
+
+
+def test_torn():
+    # the writer laps the reader while it copies: the slots it may have overwritten are discarded
+    writer, reader = open_ring(8)
+    try:
+        for i in range(5):
+            writer.put(sample(i))
+        written = reader.written
+        calls = itertools.count()
+
+        def written_while_copying():
+            if next(calls) == 1:
+                for i in range(5, 11):
+                    writer.put(sample(i))
+            return written()
+
+        reader.written = written_while_copying
+        # samples 0..3 share slots with 8..11 (11 possibly half written), only 4 is certainly intact
+        assert values(reader.drain()) == [4]
+        assert reader.overruns == 4
+        reader.written = written
+        assert values(reader.drain()) == list(range(5, 11))
+        assert reader.overruns == 4
+    finally:
+        close_ring(writer, reader)
+
+
+def test_stale_ring():
+    # a ring left by a crashed writer is replaced, not attached to
+    writer, reader = open_ring(4)
+    reader.close()
+    writer.put(sample(1))
+    writer.close()
+    writer = SharedRing(writer.name, Sample, "<d", capacity=8, create=True)
+    reader = SharedRing(writer.name, Sample, "<d")
+    try:
+        assert (reader.capacity, reader.written()) == (8, 0)
+    finally:
+        close_ring(writer, reader)
+
+
+if __name__ == "__main__":
+    for test in (test_drain, test_lapped, test_torn, test_stale_ring):
+        test()
+        print(f"{test.__name__}: ok")
@@ -25,7 +25,6 @@ SOFTWARE.
 """
 
 import sys
-import json
 from time import sleep
 from sps30.sps30 import SPS30
 
@@ -44,7 +43,9 @@ if __name__ == "__main__":
     
     while True:
         try:
-            print(json.dumps(pm_sensor.get_measurement(), indent=2))
+            result = pm_sensor.get_measurement()
+            if result:
+                print(result.to_json(3, indent=2))
             sleep(2)
 
         except KeyboardInterrupt: